@@ -38,13 +38,13 @@ from model import Account
 ACTIONS = ['view', 'add', 'remove', 'edit', 'advanced_edit', 'grant', 'purge']
 
 def check_token(token):
-    return Account.all().filter('token =', token).get()
+    return cache.ACCOUNTS.get('token', token)
 
 def check_email(email):
-    return Account.all().filter('email =', email).get()
+    return cache.ACCOUNTS.get('email', email)
 
 def check_user_id(user_id):
-    return Account.all().filter('user_id =', user_id).get()
+    return cache.ACCOUNTS.get('user_id', user_id)
 
 def check_request(request, user):
     if request.get('access_token'):
@@ -61,16 +61,61 @@ def get_default_permissions():
     account = cache.DEFAULT_ACCOUNT.get()
     return account and account.actions or []
 
+def compile_verbs(actions, subdomain):
+    """Gets the set of verbs that the given actions permit in the given
+    subdomain, including '*' if they permit every verb."""
+    # Items in the Account.actions list have the form subdomain + ':' + verb,
+    # where '*' can be used a wildcard for the subdomain or the verb.
+    verbs = set()
+    for item in actions:
+        if ':' in item:
+            item_subdomain, verb = item.split(':', 1)
+            if item_subdomain in [subdomain, '*']:
+                verbs.add(verb)
+    return frozenset(verbs)
+
+# Compiled sets of verbs, keyed by the default actions, the account's
+# actions, and the subdomain they were compiled from, so that a set is
+# recompiled only when the permissions change.
+compiled_verbs = {}
+MAX_COMPILED_VERBS = 1000
+
+def get_permitted_verbs(account, subdomain):
+    """Gets the set of verbs the account is allowed to perform in the given
+    subdomain (see compile_verbs).  The set is memoized on the Account object
+    (or for users without one, on the default Account), so it is looked up
+    once per request, and again only if the account's actions or the default
+    actions are replaced or added to."""
+    default_account = cache.DEFAULT_ACCOUNT.get()
+    holder = account or default_account
+    if not holder:
+        return frozenset()
+    default_actions = default_account and default_account.actions
+    account_actions = account and account.actions
+    count = len(default_actions or []) + len(account_actions or [])
+    if not hasattr(holder, 'permitted_verbs'):
+        holder.permitted_verbs = {}  # {subdomain: (actions, count, verbs)}
+    actions, memo_count, verbs = holder.permitted_verbs.get(
+        subdomain, (None, None, None))
+    if (actions and actions[0] is default_actions and
+        actions[1] is account_actions and memo_count == count):
+        return verbs
+
+    key = (tuple(default_actions or []), tuple(account_actions or []),
+           subdomain)
+    if key not in compiled_verbs:
+        if len(compiled_verbs) >= MAX_COMPILED_VERBS:
+            compiled_verbs.clear()
+        compiled_verbs[key] = compile_verbs(key[0] + key[1], subdomain)
+    holder.permitted_verbs[subdomain] = (
+        (default_actions, account_actions), count, compiled_verbs[key])
+    return compiled_verbs[key]
+
 def check_action_permitted(account, subdomain, action):
     """Returns True if the account is allowed to perform the given action
     in the given subdomain."""
-    # Items in the Account.actions list have the form subdomain + ':' + verb,
-    # where '*' can be used a wildcard for the subdomain or the verb.
-    actions = get_default_permissions() + (account and account.actions or [])
-    return ('%s:%s' % (subdomain, action) in actions or
-            '%s:*' % subdomain in actions or
-            '*:%s' % action in actions or
-            '*:*' in actions)
+    verbs = get_permitted_verbs(account, subdomain)
+    return action in verbs or '*' in verbs
 
 def check_and_log(request, user):
     account = check_request(request, user)
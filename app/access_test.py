@@ -20,6 +20,7 @@ import unittest
 from google.appengine.api import users
 
 import access
+import cache
 
 from access import ACTIONS
 from feedlib.xml_utils import Struct
@@ -74,6 +75,32 @@ class AccessTest(MediumTestCase):
         assert access.check_action_permitted(self.account, 'bar', 'view')
         assert access.check_action_permitted(self.account, 'xyz', 'view')
         assert not access.check_action_permitted(self.account, 'xyz', 'grant')
+
+    def test_permitted_verbs_memo(self):
+        # the verbs are compiled once per account and subdomain
+        verbs = access.get_permitted_verbs(self.account, 'foo')
+        assert verbs == frozenset(['view', 'add'])
+        assert access.get_permitted_verbs(self.account, 'foo') is verbs
+        assert 'foo' in self.account.permitted_verbs
+
+        # adding to or replacing the account's actions takes effect at once
+        self.account.actions.append('foo:edit')
+        assert access.check_action_permitted(self.account, 'foo', 'edit')
+        self.account.actions = ['foo:remove']
+        assert access.check_action_permitted(self.account, 'foo', 'remove')
+        assert not access.check_action_permitted(self.account, 'foo', 'edit')
+
+    def test_permitted_verbs_default(self):
+        # users without an Account get the default permissions
+        Account(key_name='default', actions=['*:view']).put()
+        cache.DEFAULT_ACCOUNT.flush()
+        try:
+            assert access.check_action_permitted(None, 'xyz', 'view')
+            assert not access.check_action_permitted(None, 'xyz', 'add')
+            assert access.check_action_permitted(self.account, 'foo', 'add')
+            assert access.check_action_permitted(self.account, 'xyz', 'view')
+        finally:
+            cache.DEFAULT_ACCOUNT.flush()
     
     def test_check_and_log(self):
         # should produce same results as access.check_request() in 
@@ -0,0 +1,79 @@
+# Copyright 2010 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Migration task that fills in the last_updated property of Subjects and
+MinimalSubjects stored before it existed.  Each task handles one batch of
+Subjects and queues a task for the next batch; visit the URL as an admin
+to start the migration."""
+
+import logging
+
+import cache
+import model
+import utils
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import db
+
+# Number of Subjects examined by each task.
+BATCH_SIZE = 100
+
+
+def backfill(subdomain, subject_name, last_updated):
+    """Sets last_updated on a Subject and its MinimalSubject, unless an edit
+    has set it already.  Runs in a transaction."""
+    subject, minimal_subject = model.Subject.get_pairs(
+        subdomain, [subject_name])[0]
+    if subject and not subject.last_updated:
+        subject.last_updated = last_updated
+        subject.put()
+        if minimal_subject:
+            minimal_subject.last_updated = last_updated
+            minimal_subject.put()
+        return True
+    return False
+
+
+class BackfillLastUpdated(utils.Handler):
+    def get(self):
+        query = model.Subject.all()
+        if self.request.get('cursor'):
+            query.with_cursor(self.request.get('cursor'))
+        subjects = query.fetch(BATCH_SIZE)
+
+        count = 0
+        for subject in subjects:
+            if subject.last_updated:
+                continue
+            observed = subject.get_latest_observed()
+            if observed and db.run_in_transaction(
+                backfill, subject.subdomain, subject.name, observed):
+                count += 1
+        logging.info('backfill_last_updated.py: updated %d of %d Subjects' %
+                     (count, len(subjects)))
+
+        if len(subjects) == BATCH_SIZE:
+            taskqueue.add(url='/tasks/backfill_last_updated', method='GET',
+                          params={'cursor': query.cursor()})
+        else:
+            # The cached copies of the Subjects and MinimalSubjects lack
+            # the new property, so flush them once all the batches are done.
+            cache.SUBJECTS.flush()
+            for subdomain in cache.SUBDOMAINS.keys():
+                cache.MINIMAL_SUBJECTS[subdomain].flush()
+            logging.info('backfill_last_updated.py: done')
+
+if __name__ == '__main__':
+    utils.run([('/tasks/backfill_last_updated', BackfillLastUpdated)],
+              debug=True)
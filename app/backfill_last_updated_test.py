@@ -0,0 +1,81 @@
+# Copyright 2010 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for backfill_last_updated.py."""
+
+import datetime
+import urllib
+import webob
+
+from google.appengine.ext import db, webapp
+
+import backfill_last_updated
+from medium_test_case import MediumTestCase
+from model import MinimalSubject, Subject
+
+class BackfillLastUpdatedTest(MediumTestCase):
+    def setUp(self):
+        MediumTestCase.setUp(self)
+        self.t1 = datetime.datetime(2010, 1, 1)
+        self.t2 = datetime.datetime(2010, 1, 2)
+        entities = []
+        for name, observed in [('example.org/1', self.t1),
+                               ('example.org/2', self.t2)]:
+            subject = Subject.create('haiti', 'hospital', name, None)
+            subject.set_attribute('title', name, observed,
+                                  None, None, None, None)
+            subject.last_updated = None  # as before last_updated existed
+            entities += [subject, MinimalSubject.create(subject)]
+        # A Subject whose last_updated was already set by an edit.
+        subject = Subject.create('haiti', 'hospital', 'example.org/3', None)
+        subject.set_attribute('title', 'foo', self.t1, None, None, None, None)
+        subject.last_updated = self.t2
+        entities += [subject, MinimalSubject.create(subject)]
+        db.put(entities)
+
+        # Run the chained tasks here instead of queueing them.
+        self.tasks = []
+        self.add = backfill_last_updated.taskqueue.add
+        backfill_last_updated.taskqueue.add = (
+            lambda **kwargs: self.tasks.append(kwargs['params']))
+        self.batch_size = backfill_last_updated.BATCH_SIZE
+        backfill_last_updated.BATCH_SIZE = 2
+
+    def tearDown(self):
+        backfill_last_updated.taskqueue.add = self.add
+        backfill_last_updated.BATCH_SIZE = self.batch_size
+        db.delete(Subject.all(keys_only=True).fetch(10))
+        db.delete(MinimalSubject.all(keys_only=True).fetch(10))
+
+    def run_task(self, path):
+        request = webapp.Request(webob.Request.blank(path).environ)
+        handler = backfill_last_updated.BackfillLastUpdated()
+        handler.initialize(request, webapp.Response(), None)
+        handler.get()
+
+    def test_backfill(self):
+        """Confirms that the migration sets last_updated on the Subjects and
+        MinimalSubjects that lack it, one batch at a time."""
+        self.run_task('/tasks/backfill_last_updated')
+        assert len(self.tasks) == 1
+        self.run_task('/tasks/backfill_last_updated?cursor=' +
+                      urllib.quote(self.tasks[0]['cursor']))
+        assert len(self.tasks) == 1  # the last batch queues no task
+
+        for name, last_updated in [('example.org/1', self.t1),
+                                   ('example.org/2', self.t2),
+                                   ('example.org/3', self.t2)]:
+            subject, minimal_subject = Subject.get_pairs('haiti', [name])[0]
+            assert subject.last_updated == last_updated
+            assert minimal_subject.last_updated == last_updated
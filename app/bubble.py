@@ -168,7 +168,7 @@ class Bubble(Handler):
         # Need 'view' permission to see a bubble.
         self.require_action_permitted('view')
 
-        subject = model.Subject.get(self.subdomain, self.params.subject_name)
+        subject = cache.SUBJECTS.get(self.subdomain, self.params.subject_name)
         if not subject:
             #i18n: Error message for request missing subject name.
             raise ErrorMessage(404, _('Invalid or missing subject name.'))
@@ -12,78 +12,663 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import config
+import cPickle
+import datetime
+import hashlib
 import logging
+import marshal
+from feedlib.geo import GridIndex, get_tile
 import model
+import re
 import time
 import utils
 import UserDict
 
 from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.datastore import entity_pb
+from google.appengine.ext import db
 
 """Caching layer for Resource Finder, taking advantage of both memcache
 and in-memory caches."""
 
+# Size in degrees of the cells in the spatial index of MinimalSubjects.
+SPATIAL_INDEX_CELL_SIZE = 0.1
+
+# Maximum zoom level of the map tiles of subjects served by tiles.py.
+MAX_TILE_ZOOM = 18
+
+# Age in seconds after which a value in memcache is stale: it is still served,
+# but a task is queued to rebuild it in the background (see queue_refresh).
+SOFT_TTL_SECONDS = 3600
+
+# Age in seconds after which a value expires from memcache and is no longer
+# served at all.
+HARD_TTL_SECONDS = 24*3600
+
+# Seconds for which a request rebuilding a Cache holds its lease, after which
+# another request may take over if the first one has died.
+LEASE_SECONDS = 10
+
+# Maximum seconds to wait for another request to rebuild a Cache, and how
+# often to check whether it has finished.
+LEASE_WAIT_SECONDS = 1.0
+LEASE_POLL_SECONDS = 0.1
+
+# Seconds between additions of the locally collected CacheStats to the
+# totals in memcache.
+STATS_FLUSH_SECONDS = 60
+
+# Upper bounds in milliseconds of the buckets of the load latency histogram.
+LOAD_LATENCY_BUCKETS_MS = [10, 30, 100, 300, 1000, 3000, 10000]
+
+# Limits on the caches of a CacheGroup that hold entities in local memory
+# at once, by number and by total size in bytes (as pickled in memcache).
+MAX_RESIDENT_CACHES = 20
+MAX_RESIDENT_BYTES = 32*1024*1024
+
+# Maximum size in bytes of a value stored in one memcache entry.  Memcache
+# rejects values over 1 MB, and the key and pickling overhead count too.
+MAX_CHUNK_SIZE = 1000000
+
+
+def get_generation_key(name):
+    return name + '.generation'
+
+def get_generation(name):
+    """Gets the generation of the cache with the given name, a number that is
+    embedded in the memcache keys of all its values.  Flushing the cache just
+    increments the generation (see next_generation), so old values are never
+    read again and age out of memcache on their own.  A missing counter
+    (never set, or evicted) starts at the current time in milliseconds, so
+    that a generation is never reused after an eviction."""
+    key = get_generation_key(name)
+    generation = memcache.get(key)
+    if generation is None:
+        memcache.add(key, int(time.time()*1000))
+        generation = memcache.get(key)
+        if generation is None:  # memcache is unavailable; force a miss
+            generation = int(time.time()*1000)
+    return generation
+
+def get_generations(names):
+    """Gets the generations of the caches with the given names in one
+    memcache round trip, as a dictionary keyed by name."""
+    names_by_key = dict((get_generation_key(name), name) for name in names)
+    generations = {}
+    for key, generation in memcache.get_multi(names_by_key.keys()).items():
+        generations[names_by_key[key]] = generation
+    for name in names:
+        if name not in generations:
+            generations[name] = get_generation(name)
+    return generations
+
+def next_generation(name):
+    """Invalidates all the values of the cache with the given name in one
+    atomic memcache operation by incrementing its generation."""
+    key = get_generation_key(name)
+    if memcache.incr(key) is None:
+        memcache.add(key, int(time.time()*1000))
+
+def queue_refresh(name, **params):
+    """Queues a task to rebuild a stale cache value in the background (see
+    refresh_cache.py) with the given parameters.  Only one task is queued
+    for each 'name', however many readers find the value stale."""
+    try:
+        taskqueue.add(name=re.sub('[^a-zA-Z0-9-]', '-', 'refresh-' + name),
+                      url='/tasks/refresh_cache', params=params, method='GET')
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass  # the value is already being rebuilt
+
+def get_chunk_key(key, checksum, index):
+    return '%s:%s.%d' % (key, checksum, index)
+
+def set_multi_chunked(mapping, time=0, stats=None, sizes=None):
+    """Like memcache.set_multi, but values too large for one memcache entry
+    are split into shards.  The entry under each key holds a manifest
+    (shard count, checksum, data); small values are stored inline in the
+    manifest's data with a shard count of 0.  Shard keys include the
+    checksum, so concurrent writers never mix their shards.  If 'stats' is
+    given, records the total size of the pickled values in it; if 'sizes' is
+    given, puts the size of each pickled value in it by key.  Returns the
+    list of keys that could not be set."""
+    manifests = {}
+    shards = {}
+    size = 0
+    for key, value in mapping.items():
+        data = cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL)
+        size += len(data)
+        if sizes is not None:
+            sizes[key] = len(data)
+        if len(data) <= MAX_CHUNK_SIZE:
+            manifests[key] = (0, None, data)
+        else:
+            checksum = hashlib.md5(data).hexdigest()
+            chunks = [data[i:i + MAX_CHUNK_SIZE]
+                      for i in range(0, len(data), MAX_CHUNK_SIZE)]
+            for i, chunk in enumerate(chunks):
+                shards[get_chunk_key(key, checksum, i)] = chunk
+            manifests[key] = (len(chunks), checksum, None)
+
+    if stats:
+        stats.record_size(size)
+
+    # Write the shards before the manifests that refer to them, and skip
+    # the manifest of any value whose shards were not all written.
+    failed_keys = []
+    if shards:
+        failed_shard_keys = memcache.set_multi(shards, time)
+        for key in manifests.keys():
+            count, checksum, data = manifests[key]
+            for i in range(count):
+                if get_chunk_key(key, checksum, i) in failed_shard_keys:
+                    del manifests[key]
+                    failed_keys.append(key)
+                    break
+    return failed_keys + memcache.set_multi(manifests, time)
+
+def get_multi_chunked(keys, sizes=None):
+    """Like memcache.get_multi, for values stored by set_multi_chunked.
+    Reads all the manifests, then all the shards in one get_multi.  A value
+    with missing or corrupted shards is treated as a miss.  If 'sizes' is
+    given, puts the size of each pickled value in it by key."""
+    manifests = memcache.get_multi(keys)
+    for key, manifest in manifests.items():
+        if not (isinstance(manifest, tuple) and len(manifest) == 3):
+            del manifests[key]  # not written by set_multi_chunked
+    shard_keys = []
+    for key, (count, checksum, data) in manifests.items():
+        shard_keys += [get_chunk_key(key, checksum, i) for i in range(count)]
+    shards = shard_keys and memcache.get_multi(shard_keys) or {}
+
+    values = {}
+    for key, (count, checksum, data) in manifests.items():
+        if count:
+            try:
+                data = ''.join([shards[get_chunk_key(key, checksum, i)]
+                                for i in range(count)])
+            except KeyError:
+                logging.warning('Memcache shards of %s missing' % key)
+                continue
+            if hashlib.md5(data).hexdigest() != checksum:
+                logging.warning('Memcache shards of %s corrupted' % key)
+                continue
+        values[key] = cPickle.loads(data)
+        if sizes is not None:
+            sizes[key] = len(data)
+    return values
+
+
+class CacheStats:
+    """Counters of the lookups in one cache: 'hits' (in local memory or
+    memcache), 'local_hits', 'memcache_hits', 'misses', 'loads' (from the
+    datastore, or renders for the JSON caches), and 'evictions' (from local
+    memory, by a CacheGroup), with a histogram of the load latency and the
+    size of the last value stored.  Counts and the size are collected in
+    local memory and written to memcache every STATS_FLUSH_SECONDS, so
+    counting costs no memcache calls of its own."""
+    def __init__(self, name):
+        self.name = name
+        self.counts = {}
+        self.size = None  # size of the last value stored, if not yet written
+        self.last_flush = time.time()
+
+    def count(self, counter, n=1):
+        """Adds n to a counter."""
+        self.counts[counter] = self.counts.get(counter, 0) + n
+        if time.time() - self.last_flush > STATS_FLUSH_SECONDS:
+            self.flush()
+
+    def record_load(self, seconds):
+        """Counts a load that took the given number of seconds."""
+        for bound in LOAD_LATENCY_BUCKETS_MS:
+            if seconds*1000 <= bound:
+                self.count('load_ms_%d' % bound)
+                break
+        else:
+            self.count('load_ms_more')
+        self.count('loads')
+
+    def record_size(self, size):
+        """Records the size in bytes of a value stored in memcache."""
+        self.size = size
+
+    def flush(self):
+        """Adds the locally collected counts to the totals in memcache, and
+        writes the size of the last value stored."""
+        counts, self.counts = self.counts, {}
+        size, self.size = self.size, None
+        self.last_flush = time.time()
+        if counts:
+            memcache.offset_multi(
+                counts, key_prefix=get_stats_key(self.name, ''),
+                initial_value=0)
+        if size is not None:
+            memcache.set(get_stats_key(self.name, 'size'), size)
+
+
+def get_stats_key(name, counter):
+    return 'stats:%s.%s' % (name, counter)
+
+def get_stats(name):
+    """Gets the totals in memcache of the CacheStats of the cache with the
+    given name, as a dictionary keyed by counter name."""
+    counters = ['hits', 'local_hits', 'memcache_hits', 'misses', 'loads',
+                'evictions', 'load_ms_more', 'size'] + [
+                'load_ms_%d' % bound for bound in LOAD_LATENCY_BUCKETS_MS]
+    return memcache.get_multi(
+        counters, key_prefix=get_stats_key(name, ''))
+
 
 class CacheGroup:
     """A group of caches, keyed by subdomain or namespace.  Instantiates the
     given cache class for each subdomain or namespace the first time that cache
-    is requested."""
-    def __init__(self, cache_class):
+    is requested.  For a group of Caches, 'max_caches' and 'max_bytes' limit
+    the number and total size of the caches holding entities in local memory;
+    the least recently used ones beyond the limits are flushed locally, and
+    are reloaded from memcache when next used."""
+    def __init__(self, cache_class, max_caches=None, max_bytes=None):
         """'cache_class' should be a class that (a) has a flush() method and
         (b) has a constructor taking one argument, a subdomain or namespace."""
         self.cache_class = cache_class
         self.caches = {}
+        self.max_caches = max_caches
+        self.max_bytes = max_bytes
+        self.lru = []  # keys of self.caches, least recently used first
 
     def __getitem__(self, subdomain_or_ns):
         """Gets (and optionally creates) the cache for the given subdomain
         or namespace."""
         if subdomain_or_ns not in self.caches:
             self.caches[subdomain_or_ns] = self.cache_class(subdomain_or_ns)
+        if self.max_caches or self.max_bytes:
+            if subdomain_or_ns in self.lru:
+                self.lru.remove(subdomain_or_ns)
+            self.lru.append(subdomain_or_ns)
+            self.evict(subdomain_or_ns)
         return self.caches[subdomain_or_ns]
 
+    def evict(self, keep):
+        """Flushes the local memory of the least recently used caches, other
+        than the cache for 'keep', until the caches holding entities (always
+        counting the one for 'keep') are within max_caches and max_bytes."""
+        resident = [key for key in self.lru if key != keep and
+                    self.caches[key].entities is not None]
+        count = len(resident) + 1
+        size = sum([get_resident_size(self.caches[key])
+                    for key in resident + [keep]])
+        while resident and (self.max_caches and count > self.max_caches or
+                            self.max_bytes and size > self.max_bytes):
+            cache = self.caches[resident.pop(0)]
+            count -= 1
+            size -= get_resident_size(cache)
+            cache.stats.count('evictions')
+            cache.flush_local()
+
     def flush(self):
         """Flushes all the underlying caches."""
         for cache in self.caches.values():
             cache.flush()
 
 
+def get_resident_size(cache):
+    """Gets the size in bytes of the entities a Cache holds in local memory,
+    as measured when they were pickled for memcache."""
+    return cache.entities is not None and cache.size or 0
+
+
 class JsonCache:
-    """Memcache layer for JSON rendered by rendering.py."""
+    """Memcache layer for JSON rendered by rendering.py.  The JSON is the
+    same in every language (messages.py serves the translated messages
+    apart from it), so there is one value per subdomain.  It is stored with
+    an ETag, so that handlers can answer conditional requests without
+    re-rendering.  (Responses are gzip-compressed by the App Engine front
+    end, which drops any Content-Encoding set by the app, so no compressed
+    copy is kept.)  Values older than soft_ttl are still served while a
+    task rebuilds them, until hard_ttl."""
+    soft_ttl = SOFT_TTL_SECONDS
+    hard_ttl = HARD_TTL_SECONDS
+
     def __init__(self, subdomain):
         self.subdomain = subdomain
+        self.stats = CacheStats(self.get_name())
 
-    def get_memcache_key(self, locale):
-        return '%s:%s.%s' % (self.subdomain, self.__class__.__name__, locale)
+    def get_name(self):
+        return '%s:%s' % (self.subdomain, self.__class__.__name__)
 
-    def set(self, locale, json):
-        """Sets the value in this cache for the given locale."""
-        key = self.get_memcache_key(locale)
-        if not memcache.set(key, json):
+    def get_generation(self):
+        return get_generation(self.get_name())
+
+    def get_memcache_key(self, generation):
+        return '%s.%d' % (self.get_name(), generation)
+
+    def set(self, json, version=0, generation=None):
+        """Sets the value in this cache.  'version' is the DataVersion that
+        the JSON was rendered from.  'generation' should be the generation
+        read before rendering (see get_generation), so that JSON rendered
+        from data that was flushed meanwhile is never served; it defaults to
+        the current generation.  Returns the ETag."""
+        etag = '"%d-%s"' % (version, hashlib.md5(json).hexdigest()[:16])
+        if generation is None:
+            generation = self.get_generation()
+        key = self.get_memcache_key(generation)
+        if set_multi_chunked({key: (etag, time.time(), json)},
+                             self.hard_ttl, self.stats):
+            logging.error('Memcache set of %s failed' % key)
+        return etag
+
+    def get(self):
+        """Gets the value in this cache."""
+        return self.get_with_etag()[1]
+
+    def get_with_etag(self, stale=False):
+        """Gets the ETag and the value as a pair, or (None, None) on a miss.
+        If the value is older than soft_ttl, it is returned anyway and a task
+        is queued to rebuild it.  If 'stale' is true, the value from before
+        the last flush is likewise returned (with a rebuild queued) instead
+        of a miss."""
+        generation = get_generation(self.get_name())
+        generations = [generation]
+        if stale:
+            generations.append(generation - 1)
+        for value_generation in generations:
+            key = self.get_memcache_key(value_generation)
+            value = get_multi_chunked([key]).get(key)
+            if value:
+                self.stats.count('hits')
+                self.stats.count('memcache_hits')
+                etag, stored_time, json = value
+                if (value_generation != generation or
+                    time.time() - stored_time > self.soft_ttl):
+                    queue_refresh('%s-%d-%d' % (
+                        self.get_name(), generation, stored_time),
+                        cache=self.__class__.__name__, key=self.subdomain)
+                return etag, json
+        self.stats.count('misses')
+        return None, None
+
+    def flush(self):
+        """Flushes the value in this cache."""
+        next_generation(self.get_name())
+
+
+class ColumnarJsonCache(JsonCache):
+    """Memcache layer for JSON in the columnar format rendered by
+    rendering.py, kept apart from the JSON in the default format."""
+    pass
+
+
+class TileCache:
+    """Memcache layer for the JSON of the subjects in each map tile, rendered
+    by rendering.render_tile_json.  As in JsonFragmentCache, each tile is
+    stored with the layout it was encoded for and a stamp of the subjects it
+    was encoded from (see MinimalSubjectCache.get_tile_stamp), and a tile
+    that doesn't match the current layout and stamp is a miss."""
+    def __init__(self, subdomain):
+        self.subdomain = subdomain
+
+    def get_name(self):
+        return '%s:%s' % (self.subdomain, self.__class__.__name__)
+
+    def get_generation(self):
+        return get_generation(self.get_name())
+
+    def get_memcache_key(self, generation, zoom, x, y):
+        return '%s.%d.%d.%d.%d' % (self.get_name(), generation, zoom, x, y)
+
+    def get(self, layout, stamp, zoom, x, y):
+        """Gets the JSON for the given tile, if it matches the given layout
+        and stamp."""
+        value = memcache.get(
+            self.get_memcache_key(get_generation(self.get_name()), zoom, x, y))
+        if value and value[:2] == (layout, stamp):
+            return value[2]
+
+    def set(self, layout, stamp, zoom, x, y, json, generation=None):
+        """Sets the JSON for the given tile, layout and stamp.  'generation'
+        should be the generation read before rendering, as in
+        JsonCache.set()."""
+        if generation is None:
+            generation = self.get_generation()
+        key = self.get_memcache_key(generation, zoom, x, y)
+        if not memcache.set(key, (layout, stamp, json)):
             logging.error('Memcache set of %s failed' % key)
 
-    def get(self, locale):
-        """Gets the value in this cache for the given locale."""
-        return memcache.get(self.get_memcache_key(locale))
+    def flush(self):
+        """Flushes all the tiles."""
+        next_generation(self.get_name())
+
+
+class JsonFragmentCache:
+    """Memcache layer for the JSON of individual subjects rendered by
+    rendering.py, so that rebuilding the JSON for a subdomain only needs to
+    encode the subjects that changed.  The JSON for a subject refers to
+    attributes and subject types by index, so each fragment is stored with
+    the layout (see rendering.get_layout_version) it was encoded for, and
+    fragments with a different layout are treated as misses.  Likewise each
+    fragment is stored with the stamp of the subject it was encoded from
+    (see MinimalSubjectRecord.get_stamp), and a fragment whose stamp differs
+    from the subject's current stamp is a miss.  So a render that read a
+    subject before an edit can store its fragment after the edit, but that
+    fragment is never served."""
+    def __init__(self, subdomain):
+        self.subdomain = subdomain
+
+    def get_name(self):
+        return '%s:%s' % (self.subdomain, self.__class__.__name__)
+
+    def get_generation(self):
+        return get_generation(self.get_name())
+
+    def get_memcache_key(self, generation, subject_name):
+        return '%s.%d.%s' % (self.get_name(), generation, subject_name)
+
+    def get_multi(self, layout, stamps):
+        """Gets the cached fragments that match the given layout and the
+        current stamps of the subjects, given as a dictionary keyed by
+        subject name.  Returns a dictionary of fragments keyed by subject
+        name."""
+        generation = get_generation(self.get_name())
+        names_by_key = dict((self.get_memcache_key(generation, name), name)
+                            for name in stamps)
+        fragments = {}
+        for key, value in memcache.get_multi(names_by_key.keys()).items():
+            name = names_by_key[key]
+            if value[:2] == (layout, stamps[name]):
+                fragments[name] = value[2]
+        return fragments
+
+    def set_multi(self, layout, fragments, generation=None):
+        """Sets the fragments for the given layout from a dictionary that
+        maps each subject name to a pair (stamp, fragment).  'generation'
+        should be the generation read before rendering, as in
+        JsonCache.set()."""
+        if generation is None:
+            generation = self.get_generation()
+        failed_keys = memcache.set_multi(dict(
+            (self.get_memcache_key(generation, name), (layout, stamp, fragment))
+            for name, (stamp, fragment) in fragments.items()))
+        if failed_keys:
+            logging.error('Memcache set of %d fragments in %s failed'
+                          % (len(failed_keys), self.subdomain))
+
+    def flush(self):
+        """Flushes the fragments for all subjects."""
+        next_generation(self.get_name())
+
+
+class SubjectCache:
+    """Caches Subject entities by key name, encoded as protocol buffers in
+    memcache, and in a memo in local memory that is cleared at the start of
+    each request (see flush_local).  Code that puts a Subject must write it
+    through with set() once the transaction has committed; code running in
+    a transaction must read Subjects from the datastore, not from here."""
+    ttl = SOFT_TTL_SECONDS
+
+    def __init__(self):
+        self.name = ':' + self.__class__.__name__
+        self.stats = CacheStats(self.name)
+        self.memo = {}  # {key_name: Subject or None}
+        self.generation = None  # generation read in the current request
+
+    def get_memcache_key(self, generation, key_name):
+        return '%s.%d.%s' % (self.name, generation, key_name)
+
+    def get_generation(self):
+        if self.generation is None:
+            self.generation = get_generation(self.name)
+        return self.generation
+
+    def get(self, subdomain, subject_name):
+        """Gets the Subject with the given subdomain and name, or None."""
+        return self.get_by_key_name(subdomain + ':' + subject_name)
+
+    def get_by_key_name(self, key_name):
+        """Gets the Subject with the given key name, or None."""
+        return self.get_multi_by_key_name([key_name])[key_name]
+
+    def get_multi_by_key_name(self, key_names):
+        """Gets the Subjects with the given key names, as a dictionary that
+        maps each key name to a Subject or None.  Looks in the memo, then in
+        memcache, then in the datastore, with one batch call at each level."""
+        missing = [key_name for key_name in key_names
+                   if key_name not in self.memo]
+        self.stats.count('hits', len(key_names) - len(missing))
+        self.stats.count('local_hits', len(key_names) - len(missing))
+        if missing:
+            generation = self.get_generation()
+            names_by_key = dict((self.get_memcache_key(generation, key_name),
+                                 key_name) for key_name in missing)
+            for key, data in memcache.get_multi(names_by_key.keys()).items():
+                self.memo[names_by_key[key]] = db.model_from_protobuf(
+                    entity_pb.EntityProto(data))
+            missing = [key_name for key_name in missing
+                       if key_name not in self.memo]
+            self.stats.count('hits', len(names_by_key) - len(missing))
+            self.stats.count('memcache_hits', len(names_by_key) - len(missing))
+        if missing:
+            self.stats.count('misses', len(missing))
+            start = time.time()
+            subjects = model.Subject.get_by_key_name(missing)
+            self.stats.record_load(time.time() - start)
+            mapping = {}
+            for key_name, subject in zip(missing, subjects):
+                self.memo[key_name] = subject
+                if subject:
+                    mapping[self.get_memcache_key(generation, key_name)] = \
+                        db.model_to_protobuf(subject).Encode()
+            # Use add, not set, so as not to overwrite a Subject that was
+            # written through while this one was being read.
+            memcache.add_multi(mapping, self.ttl)
+        return dict((key_name, self.memo[key_name]) for key_name in key_names)
+
+    def set(self, subject):
+        """Writes through a Subject that has just been put."""
+        key_name = subject.key().name()
+        self.memo[key_name] = subject
+        if not memcache.set(
+            self.get_memcache_key(self.get_generation(), key_name),
+            db.model_to_protobuf(subject).Encode(), self.ttl):
+            logging.error('Memcache set of Subject %s failed' % key_name)
+
+    def set_local(self, subject):
+        """Puts a Subject just read from the datastore in the memo for the
+        rest of the request, without writing it to memcache (where it could
+        replace a newer Subject written through by another request)."""
+        self.memo[subject.key().name()] = subject
+
+    def delete(self, subdomain, subject_name):
+        """Removes a Subject that has been changed or purged."""
+        key_name = subdomain + ':' + subject_name
+        self.memo.pop(key_name, None)
+        memcache.delete(self.get_memcache_key(self.get_generation(), key_name))
+
+    def flush_local(self):
+        """Clears the memo.  Called at the start of each request."""
+        self.memo = {}
+        self.generation = None
+
+    def flush(self):
+        """Flushes the memo and all the Subjects in memcache."""
+        self.flush_local()
+        next_generation(self.name)
+
+
+class AccountIndex:
+    """Caches in memcache the Account found by a query on its email,
+    user_id, or token property, or the absence of one, so that identifying
+    the user of a request needs no datastore query.  Code that puts an
+    Account must call invalidate() afterwards."""
+    ttl = 600  # seconds
+
+    def __init__(self):
+        self.name = ':' + self.__class__.__name__
+        self.stats = CacheStats(self.name)
+
+    def get_memcache_key(self, generation, property, value):
+        return '%s.%d.%s=%s' % (self.name, generation, property, value)
+
+    def get(self, property, value):
+        """Gets the Account whose given property has the given value, or
+        None if there is none."""
+        key = self.get_memcache_key(get_generation(self.name), property, value)
+        data = memcache.get(key)
+        if data is not None:
+            self.stats.count('hits')
+            self.stats.count('memcache_hits')
+            # An empty string records that there is no such Account.
+            return data and db.model_from_protobuf(entity_pb.EntityProto(data))
+        self.stats.count('misses')
+        start = time.time()
+        account = model.Account.all().filter(property + ' =', value).get()
+        self.stats.record_load(time.time() - start)
+        # Use add, not set, so as not to overwrite an invalidation.
+        memcache.add(key, account and db.model_to_protobuf(account).Encode()
+                     or '', self.ttl)
+        return account
+
+    def invalidate(self, account):
+        """Removes the entries for an Account that has been put."""
+        generation = get_generation(self.name)
+        memcache.delete_multi([
+            self.get_memcache_key(generation, property, value)
+            for property, value in [('email', account.email),
+                                    ('user_id', account.user_id),
+                                    ('token', account.token)] if value])
 
     def flush(self):
-        """Flushes the values in this cache for all locales."""
-        locales = map(utils.get_locale, dict(config.LANGUAGES).keys())
-        memcache.delete_multi(map(self.get_memcache_key, locales))
+        """Flushes all the entries."""
+        next_generation(self.name)
 
 
 class Cache(UserDict.DictMixin):
     """A cache that looks first in local memory, then in a remote memcache,
     then finally loads data from the datastore.  The local in-memory cache
     lives for ttl seconds, then is refreshed from memcache.  Transparently
-    exposes a dictionary interface to the underlying cached dictionary."""
+    exposes a dictionary interface to the underlying cached dictionary.
+    Values in memcache older than soft_ttl are still served while a task
+    rebuilds them, until they expire after hard_ttl."""
+    soft_ttl = SOFT_TTL_SECONDS
+    hard_ttl = HARD_TTL_SECONDS
+
+    # Whether a request that times out waiting for another to rebuild the
+    # cache may use the entities from before the last flush (see rebuild).
+    # Caches whose entities are rendered into other caches turn this off, so
+    # that nothing rendered from entities from before a flush is stored as
+    # current.
+    fallback = True
+
     def __init__(self, subdomain_or_ns='', ttl=30):
         assert ttl > 0
         self.subdomain_or_ns = subdomain_or_ns
         self.entities = None
+        self.generation = None  # generation of the entities in local memory
+        self.stored_time = 0  # time the entities were stored in memcache
+        self.size = 0  # size of the last value stored or read, in bytes
         self.last_refresh = 0  # last time data was loaded into local memory
         self.ttl = ttl  # maximum age in seconds for data in local memory
-        self.memcache_key = subdomain_or_ns + ':' + self.__class__.__name__
+        self.name = subdomain_or_ns + ':' + self.__class__.__name__
+        self.stats = CacheStats(self.name)
 
     def __getitem__(self, key):
         self.load()
@@ -96,18 +681,159 @@ class Cache(UserDict.DictMixin):
     def load(self):
         """Load entities into memory, if necessary."""
         now = time.time()
-        if now - self.last_refresh > self.ttl:
-            self.entities = memcache.get(self.memcache_key)
-            if self.entities is None:
-                self.entities = self.fetch_entities()
-                # TODO(shakusa) memcache has a 1MB limit for values. If any
-                # cache gets larger, we need to revisit this.
-                if not memcache.set(self.memcache_key, self.entities):
-                    logging.error('Memcache set of %s failed'
-                                  % self.memcache_key)
+        if now - self.last_refresh <= self.ttl:
+            self.stats.count('hits')
+            self.stats.count('local_hits')
+            return self.entities
+
+        generation = get_generation(self.name)
+        if self.is_current(generation, now):
+            # Nothing has changed, so the entities needn't be read again.
+            self.stats.count('hits')
+            self.stats.count('local_hits')
             self.last_refresh = now
+        else:
+            stored = self.get_stored(generation)
+            if stored:
+                self.use_stored(generation, stored, now)
+            else:
+                self.use_rebuilt(generation, now)
         return self.entities
 
+    def is_current(self, generation, now):
+        """Returns True if the entities in local memory are still valid at
+        the given generation and are not stale."""
+        return (self.entities is not None and generation == self.generation
+                and now - self.stored_time <= self.soft_ttl)
+
+    def use_stored(self, generation, stored, now):
+        """Takes the pair (stored_time, entities) read from memcache for the
+        given generation into local memory, queueing a task to rebuild the
+        value if it is stale."""
+        self.stats.count('hits')
+        self.stats.count('memcache_hits')
+        stored_time, entities = stored
+        if now - stored_time > self.soft_ttl:
+            queue_refresh('%s-%d-%d' % (self.name, generation, stored_time),
+                          cache=self.__class__.__name__,
+                          key=self.subdomain_or_ns)
+        self.entities = entities
+        self.generation = generation
+        self.stored_time = stored_time
+        self.last_refresh = now
+
+    def use_rebuilt(self, generation, now):
+        """Rebuilds the entities after a memcache miss for the given
+        generation (see rebuild) and takes them into local memory."""
+        self.stats.count('misses')
+        entities, fresh = self.rebuild(generation)
+        self.entities = entities
+        self.stored_time = self.last_refresh = now
+        if fresh:
+            self.generation = generation
+        else:
+            # Try again for the current data once the lease expires.
+            self.generation = None
+            self.last_refresh = now - self.ttl + LEASE_SECONDS
+
+    def rebuild(self, generation):
+        """Loads the entities after a memcache miss for the given generation.
+        Only one request at a time (the one holding the lease) fetches the
+        entities and stores them in memcache; the others (unless the lease
+        could not be taken for some other reason) wait for up to
+        LEASE_WAIT_SECONDS and then fall back to the previous generation's
+        value or the value in local memory, fetching the entities themselves
+        only if there is neither or the cache doesn't allow a fallback.
+        Returns a pair (entities, fresh), where 'fresh' is False if the
+        entities are from a fallback."""
+        memcache_key = self.get_memcache_key(generation)
+        lease_key = memcache_key + '.lease'
+        if memcache.add(lease_key, 1, LEASE_SECONDS):
+            try:
+                entities = self.timed_fetch_entities()
+                self.store(generation, entities)
+            finally:
+                memcache.delete(lease_key)
+            return entities, True
+        if memcache.get(lease_key) is None:
+            # The add failed although nobody holds the lease, so memcache
+            # is probably unavailable; there is nothing to wait for.
+            return self.timed_fetch_entities(), True
+
+        deadline = time.time() + LEASE_WAIT_SECONDS
+        while time.time() < deadline:
+            time.sleep(LEASE_POLL_SECONDS)
+            stored = self.get_stored(generation)
+            if stored:
+                return stored[1], True
+
+        logging.warning('Timed out waiting for %s' % memcache_key)
+        if self.fallback:
+            stored = self.get_stored(generation - 1)
+            entities = stored and stored[1] or self.entities
+            if entities is not None:
+                return entities, False
+        return self.timed_fetch_entities(), True
+
+    def refresh(self):
+        """Fetches the entities and stores them in memcache, replacing a stale
+        value.  Called from the task queued by load()."""
+        generation = get_generation(self.name)
+        self.entities = self.timed_fetch_entities()
+        self.generation = generation
+        self.stored_time = self.last_refresh = time.time()
+        self.store(generation, self.entities)
+
+    def store(self, generation, entities):
+        """Stores the entities in memcache for the given generation."""
+        memcache_key = self.get_memcache_key(generation)
+        sizes = {}
+        if set_multi_chunked(
+            {memcache_key: (time.time(), self.encode_entities(entities))},
+            self.hard_ttl, self.stats, sizes):
+            logging.error('Memcache set of %s failed' % memcache_key)
+        self.size = sizes[memcache_key]
+
+    def get_stored(self, generation):
+        """Gets the pair (stored_time, entities) stored in memcache for the
+        given generation, or None if there is none."""
+        memcache_key = self.get_memcache_key(generation)
+        sizes = {}
+        stored = get_multi_chunked([memcache_key], sizes).get(memcache_key)
+        if stored:
+            stored_time, data = stored
+            self.size = sizes[memcache_key]
+            return stored_time, self.decode_entities(data)
+
+    def encode_entities(self, entities):
+        """Converts the entities to the value that store() puts in memcache.
+        Subclasses can override this and decode_entities() to store their
+        entities in a more compact form than a pickle."""
+        return entities
+
+    def decode_entities(self, data):
+        """Converts a value produced by encode_entities() back to entities."""
+        return data
+
+    def peek(self):
+        """Gets the entities in local memory or memcache without loading them
+        from the datastore, or None if they are in neither."""
+        if self.entities is not None:
+            return self.entities
+        stored = self.get_stored(get_generation(self.name))
+        return stored and stored[1]
+
+    def get_memcache_key(self, generation):
+        """Gets the memcache key for the given generation of this cache."""
+        return '%s.%d' % (self.name, generation)
+
+    def timed_fetch_entities(self):
+        """Calls fetch_entities(), recording its latency in the stats."""
+        start = time.time()
+        entities = self.fetch_entities()
+        self.stats.record_load(time.time() - start)
+        return entities
+
     def fetch_entities(self):
         """Fetch entities on a cache miss."""
         raise NotImplementedError()
@@ -116,28 +842,195 @@ class Cache(UserDict.DictMixin):
         """Flushes the local in-memory cache."""
         self.last_refresh = 0
         self.entities = None
+        self.generation = None
+        self.size = 0
 
     def flush(self):
         """Flushes the local in-memory cache and the remote memcache."""
         self.flush_local()
-        memcache.delete(self.memcache_key)
+        next_generation(self.name)
 
 
 class SubjectTypeCache(Cache):
+    fallback = False  # the layout of the rendered JSON depends on these
+
     def fetch_entities(self):
         entities = utils.fetch_all(
             model.SubjectType.all_in_subdomain(self.subdomain_or_ns))
         return dict((e.key().name().split(':', 1)[1], e) for e in entities)
 
 
+def pack_value(value):
+    """Converts an attribute value to a form that marshal can serialize.
+    GeoPt and datetime values become tagged tuples (lists are never
+    tuples, so the tags are unambiguous); subclasses of str and unicode,
+    such as db.Text and db.Link, become plain strings."""
+    if isinstance(value, list):
+        return [pack_value(item) for item in value]
+    if isinstance(value, db.GeoPt):
+        return ('geopt', value.lat, value.lon)
+    if isinstance(value, datetime.datetime):
+        return ('datetime',) + value.timetuple()[:6] + (value.microsecond,)
+    if isinstance(value, unicode):
+        return unicode(value)
+    if isinstance(value, str):
+        return str(value)
+    return value
+
+def unpack_value(value):
+    """Converts a value produced by pack_value() back to an attribute value."""
+    if isinstance(value, list):
+        return [unpack_value(item) for item in value]
+    if isinstance(value, tuple):
+        if value[0] == 'geopt':
+            return db.GeoPt(value[1], value[2])
+        if value[0] == 'datetime':
+            return datetime.datetime(*value[1:])
+    return value
+
+
+class MinimalSubjectRecord(object):
+    """A compact, read-only stand-in for a MinimalSubject entity, as kept
+    by MinimalSubjectCache.  It offers the same name, subdomain, type,
+    last_updated, has_value() and get_value() as the entity; the attribute
+    values are held as packed by pack_value() and unpacked on access."""
+    __slots__ = ['subdomain', 'name', 'type', 'packed_last_updated', 'values',
+                 'stamp']
+
+    def __init__(self, subdomain, name, type, packed_last_updated, values):
+        self.subdomain = subdomain
+        self.name = name
+        self.type = type
+        self.packed_last_updated = packed_last_updated
+        self.values = values  # {attribute name: packed value}
+        self.stamp = None  # computed by get_stamp() when first needed
+
+    @staticmethod
+    def from_entity(minimal_subject):
+        """Makes a MinimalSubjectRecord from a MinimalSubject entity."""
+        values = {}
+        for stored_name in minimal_subject.dynamic_properties():
+            if stored_name.endswith('__'):
+                values[stored_name[:-2]] = pack_value(
+                    getattr(minimal_subject, stored_name))
+        return MinimalSubjectRecord(
+            minimal_subject.subdomain, minimal_subject.name,
+            minimal_subject.type, pack_value(minimal_subject.last_updated),
+            values)
+
+    def get_last_updated(self):
+        return unpack_value(self.packed_last_updated)
+    last_updated = property(get_last_updated)
+
+    def get_stamp(self):
+        """Gets a short digest of the type and attribute values, which
+        changes whenever the JSON rendered for the subject could change."""
+        if self.stamp is None:
+            self.stamp = hashlib.md5(marshal.dumps(
+                (self.type, sorted(self.values.items())))).hexdigest()[:16]
+        return self.stamp
+
+    def get_name(self):
+        return self.name
+
+    def get_subdomain(self):
+        return self.subdomain
+
+    def key(self):
+        """Gets the key of the MinimalSubject entity."""
+        return model.MinimalSubject.get_key(self.subdomain, self.name)
+
+    def parent(self):
+        """Gets the Subject entity (from SUBJECTS)."""
+        return SUBJECTS.get(self.subdomain, self.name)
+
+    def has_value(self, attribute_name):
+        return attribute_name in self.values
+
+    def get_value(self, attribute_name, default=None):
+        if attribute_name in self.values:
+            return unpack_value(self.values[attribute_name])
+        return default
+
+
 class MinimalSubjectCache(Cache):
+    """Caches the MinimalSubjects of a subdomain as MinimalSubjectRecords,
+    which are stored in memcache with marshal, not as pickled entities."""
+    fallback = False  # the rendered JSON, tiles and fragments depend on these
+    spatial_index = None  # GridIndex of subject names by location
+    spatial_index_entities = None  # the entities spatial_index was built from
+    tile_buckets = None  # {zoom: {(x, y): [subject names]}}
+    tile_buckets_entities = None  # the entities tile_buckets were built from
+
     def fetch_entities(self):
         entities = utils.fetch_all(
             model.MinimalSubject.all_in_subdomain(self.subdomain_or_ns))
-        return dict((e.key().name().split(':', 1)[1], e) for e in entities)
+        return dict((e.key().name().split(':', 1)[1],
+                     MinimalSubjectRecord.from_entity(e)) for e in entities)
+
+    def encode_entities(self, entities):
+        return marshal.dumps([
+            (record.name, record.type, record.packed_last_updated,
+             record.values) for record in entities.values()])
+
+    def decode_entities(self, data):
+        return dict((name, MinimalSubjectRecord(
+            self.subdomain_or_ns, name, type, last_updated, values))
+            for name, type, last_updated, values in marshal.loads(data))
+
+    def flush_local(self):
+        Cache.flush_local(self)
+        self.spatial_index = self.spatial_index_entities = None
+        self.tile_buckets = self.tile_buckets_entities = None
+
+    def get_spatial_index(self):
+        """Gets a GridIndex of the names of the MinimalSubjects by location.
+        The index is rebuilt whenever the entities are reloaded, so edits
+        (which flush this cache) are reflected in it."""
+        entities = self.load()
+        if self.spatial_index_entities is not entities:
+            index = GridIndex(SPATIAL_INDEX_CELL_SIZE)
+            for name, minimal_subject in entities.items():
+                location = minimal_subject.get_value('location')
+                if location:
+                    index.add({'lat': location.lat, 'lon': location.lon}, name)
+            self.spatial_index = index
+            self.spatial_index_entities = entities
+        return self.spatial_index
+
+    def get_tile_names(self, zoom, x, y):
+        """Gets the names of the MinimalSubjects located in the given map tile
+        (see feedlib.geo.get_tile).  The subjects are bucketed by tile once
+        per zoom level each time the entities are reloaded."""
+        entities = self.load()
+        if self.tile_buckets_entities is not entities:
+            self.tile_buckets = {}
+            self.tile_buckets_entities = entities
+        if zoom not in self.tile_buckets:
+            buckets = self.tile_buckets[zoom] = {}
+            for name, minimal_subject in entities.items():
+                location = minimal_subject.get_value('location')
+                if location:
+                    tile = get_tile(
+                        {'lat': location.lat, 'lon': location.lon}, zoom)
+                    buckets.setdefault(tile, []).append(name)
+        return self.tile_buckets[zoom].get((x, y), [])
+
+    def get_tile_stamp(self, zoom, x, y):
+        """Gets a short digest of the names and stamps (see
+        MinimalSubjectRecord.get_stamp) of the MinimalSubjects in the given
+        map tile, which changes whenever the JSON rendered for the tile
+        could change."""
+        entities = self.load()
+        return hashlib.md5(marshal.dumps([
+            (name, entities[name].get_stamp())
+            for name in sorted(self.get_tile_names(zoom, x, y))])
+            ).hexdigest()[:16]
 
 
 class AttributeCache(Cache):
+    fallback = False  # the layout of the rendered JSON depends on these
+
     def fetch_entities(self):
         entities = utils.fetch_all(model.Attribute.all())
         return dict((e.key().name(), e) for e in entities)
@@ -151,10 +1044,28 @@ class MailUpdateTextCache(Cache):
 
 
 class MessageCache(Cache):
+    version = None  # hash of the Message entities
+    version_entities = None  # the entities version was computed from
+
     def fetch_entities(self):
         entities = utils.fetch_all(model.Message.all())
         return dict(((e.ns, e.name), e) for e in entities)
 
+    def get_version(self):
+        """Gets a short hash of all the Message entities, which changes
+        whenever a message is added, removed, or translated."""
+        entities = self.load()
+        if self.version_entities is not entities:
+            digest = hashlib.md5()
+            for key in sorted(entities.keys()):
+                message = entities[key]
+                digest.update(repr((key, [
+                    (name, getattr(message, name))
+                    for name in sorted(message.dynamic_properties())])))
+            self.version = digest.hexdigest()[:16]
+            self.version_entities = entities
+        return self.version
+
 
 class SubdomainCache(Cache):
     def fetch_entities(self):
@@ -175,22 +1086,125 @@ class DefaultAccountCache(Cache):
 
 # These types have a separate cache for each subdomain.
 JSON = CacheGroup(JsonCache)
-SUBJECT_TYPES = CacheGroup(SubjectTypeCache)
-MINIMAL_SUBJECTS = CacheGroup(MinimalSubjectCache)
+COLUMNAR_JSON = CacheGroup(ColumnarJsonCache)
+JSON_FRAGMENTS = CacheGroup(JsonFragmentCache)
+TILES = CacheGroup(TileCache)
+SUBJECT_TYPES = CacheGroup(
+    SubjectTypeCache, MAX_RESIDENT_CACHES, MAX_RESIDENT_BYTES)
+MINIMAL_SUBJECTS = CacheGroup(
+    MinimalSubjectCache, MAX_RESIDENT_CACHES, MAX_RESIDENT_BYTES)
 
 # These types have a separate cache for each namespace.
-MAIL_UPDATE_TEXTS = CacheGroup(MailUpdateTextCache)
+MAIL_UPDATE_TEXTS = CacheGroup(
+    MailUpdateTextCache, MAX_RESIDENT_CACHES, MAX_RESIDENT_BYTES)
 
 # Each of these caches is shared across all subdomains.
+SUBJECTS = SubjectCache()
+ACCOUNTS = AccountIndex()
 ATTRIBUTES = AttributeCache()
 MESSAGES = MessageCache()
 DEFAULT_ACCOUNT = DefaultAccountCache()
 SUBDOMAINS = SubdomainCache()
 
-CACHES = [JSON, SUBJECT_TYPES, MINIMAL_SUBJECTS, ATTRIBUTES, MESSAGES,
+CACHES = [JSON, COLUMNAR_JSON, JSON_FRAGMENTS, TILES, SUBJECT_TYPES,
+          MINIMAL_SUBJECTS, SUBJECTS, ACCOUNTS, ATTRIBUTES, MESSAGES,
           DEFAULT_ACCOUNT, SUBDOMAINS, MAIL_UPDATE_TEXTS]
 
+def get_cache(class_name, subdomain_or_ns):
+    """Gets the cache in CACHES of the given class for the given subdomain or
+    namespace."""
+    for cache in CACHES:
+        if isinstance(cache, CacheGroup):
+            if cache.cache_class.__name__ == class_name:
+                return cache[subdomain_or_ns]
+        elif cache.__class__.__name__ == class_name:
+            return cache
+
+def prefetch(subdomain, class_names):
+    """Brings the caches with the given class names (see get_cache) for the
+    given subdomain up to date, reading the generations of all of them in
+    one memcache round trip and the values of all the stale ones in another,
+    instead of one or two round trips per cache as each is first used.
+    Caches flushed (on any instance) since they were loaded are reloaded
+    even within their ttl, so handlers call this once per request to keep
+    the local entities for as long as nothing has changed, and no longer.
+    Any misses are then rebuilt one by one."""
+    caches = [get_cache(class_name, subdomain) for class_name in class_names]
+    generations = get_generations([cache.name for cache in caches])
+    now = time.time()
+    stale_caches = []
+    for cache in caches:
+        generation = generations[cache.name]
+        if cache.is_current(generation, now):
+            if now - cache.last_refresh > cache.ttl:
+                cache.stats.count('hits')
+                cache.stats.count('local_hits')
+                cache.last_refresh = now
+        elif now - cache.last_refresh > cache.ttl or (
+            cache.generation is not None and generation != cache.generation):
+            stale_caches.append(cache)
+
+    keys = [cache.get_memcache_key(generations[cache.name])
+            for cache in stale_caches]
+    sizes = {}
+    values = get_multi_chunked(keys, sizes)
+    for cache, key in zip(stale_caches, keys):
+        if key in values:
+            stored_time, data = values[key]
+            cache.size = sizes[key]
+            cache.use_stored(generations[cache.name],
+                             (stored_time, cache.decode_entities(data)), now)
+        else:
+            cache.use_rebuilt(generations[cache.name], now)
+
+def get_all_stats():
+    """Gets the totals of the CacheStats of all the caches in CACHES for all
+    subdomains, as a dictionary keyed by cache name."""
+    subdomains = SUBDOMAINS.keys()
+    names = []
+    for cache in CACHES:
+        if isinstance(cache, CacheGroup):
+            if cache.cache_class in [JsonFragmentCache, TileCache]:
+                continue  # these have no stats
+            # The namespaces of MAIL_UPDATE_TEXTS aren't listed anywhere, so
+            # only those used on this instance are included.
+            keys = cache is MAIL_UPDATE_TEXTS and cache.caches.keys() or (
+                subdomains)
+            names += [key + ':' + cache.cache_class.__name__ for key in keys]
+        else:
+            names.append(cache.name)
+    return dict((name, get_stats(name)) for name in names)
+
+def flush_stats():
+    """Adds the CacheStats counts collected on this instance to the totals
+    in memcache without waiting for STATS_FLUSH_SECONDS."""
+    for cache in CACHES:
+        if isinstance(cache, CacheGroup):
+            instances = cache.caches.values()
+        else:
+            instances = [cache]
+        for instance in instances:
+            if hasattr(instance, 'stats'):
+                instance.stats.flush()
+
 def flush_all():
     """Flush all caches."""
     for cache in CACHES:
         cache.flush()
+
+def flush_subject(subdomain, subject_name, subject=None):
+    """Flushes the caches that depend on the given Subject.  Call this after
+    the transaction that added, changed, or purged the Subject has committed;
+    if the caches were flushed inside the transaction, a concurrent request
+    could fill them again with the old data before the commit.  'subject' is
+    the Subject as put, which is written through to SUBJECTS, or None if the
+    Subject was purged."""
+    MINIMAL_SUBJECTS[subdomain].flush()
+    JSON[subdomain].flush()
+    COLUMNAR_JSON[subdomain].flush()
+    # The Subject's fragment in JSON_FRAGMENTS and the tiles it was in no
+    # longer match its stamp, so they needn't be flushed.
+    if subject:
+        SUBJECTS.set(subject)
+    else:
+        SUBJECTS.delete(subdomain, subject_name)
@@ -0,0 +1,32 @@
+# Copyright 2010 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Admin handler that shows the hit, miss, load latency, and size counters
+of all the caches (see cache.CacheStats) as JSON.  The counts of each
+instance reach memcache every cache.STATS_FLUSH_SECONDS, so they lag by up
+to that long."""
+
+import cache
+import rendering
+import utils
+
+class CacheStats(utils.Handler):
+    def get(self):
+        # Include the counts collected so far on this instance.
+        cache.flush_stats()
+        self.response.headers['Content-Type'] = 'application/json'
+        self.write(rendering.to_json(cache.get_all_stats(), indent=2))
+
+if __name__ == '__main__':
+    utils.run([('/cache_stats', CacheStats)], debug=True)
@@ -15,13 +15,31 @@
 """Tests for cache.py."""
 
 import cache
+import datetime
 import medium_test_case
 import os
+import time
 
 from google.appengine.api import memcache
 from google.appengine.ext import db
 from medium_test_case import MediumTestCase
-from model import Message
+from model import Account, Message, MinimalSubject, Subject
+
+class ChunkedTest(MediumTestCase):
+    def test_chunked(self):
+        """Confirms that values too large for one memcache entry are split
+        into shards, and that a missing shard is treated as a miss."""
+        small = {'a': 1}
+        large = 'x' * (cache.MAX_CHUNK_SIZE * 2)
+        assert cache.set_multi_chunked({'small': small, 'large': large}) == []
+        assert cache.get_multi_chunked(['small', 'large', 'none']) == {
+            'small': small, 'large': large}
+
+        count, checksum, data = memcache.get('large')
+        assert count == 3
+        memcache.delete(cache.get_chunk_key('large', checksum, 1))
+        assert cache.get_multi_chunked(['small', 'large']) == {'small': small}
+
 
 class JsonCacheTest(MediumTestCase):
     def setUp(self):
@@ -33,35 +51,310 @@ class JsonCacheTest(MediumTestCase):
 
     def test_json_cache(self):
         """Confirms that the JsonCache works as expected."""
-        en_json = 'fake en json'
-        fr_json = 'fake fr json'
-
         # start out empty
-        assert cache.JSON['foo'].get('en') == None
-        assert cache.JSON['foo'].get('fr') == None
-
-        # fill the cache for subdomain 'bar'
-        cache.JSON['bar'].set('en', 'bar en')
-        cache.JSON['bar'].set('fr', 'bar fr')
+        assert cache.JSON['foo'].get() == None
 
-        # fill the cache for en only
-        cache.JSON['foo'].set('en', en_json)
-        assert cache.JSON['foo'].get('en') == en_json
-        assert cache.JSON['foo'].get('fr') == None
+        # fill the cache for subdomains 'foo' and 'bar'
+        cache.JSON['foo'].set('foo json')
+        cache.JSON['bar'].set('bar json')
+        assert cache.JSON['foo'].get() == 'foo json'
+        assert cache.JSON['bar'].get() == 'bar json'
 
-        # now fill for fr
-        cache.JSON['foo'].set('fr', fr_json)
-        assert cache.JSON['foo'].get('en') == en_json
-        assert cache.JSON['foo'].get('fr') == fr_json
+        # the ETag depends on the data version and the JSON
+        etag = cache.JSON['foo'].get_with_etag()[0]
+        assert cache.JSON['foo'].set('foo json') == etag
+        assert cache.JSON['foo'].set('foo json', 1) != etag
+        assert cache.JSON['foo'].set('new foo json') != etag
 
-        # flush should clear all locales
+        # flush should clear the value
         cache.JSON['foo'].flush()
-        assert cache.JSON['foo'].get('en') == None
-        assert cache.JSON['foo'].get('fr') == None
+        assert cache.JSON['foo'].get() == None
 
         # other subdomain should be unaffected
-        assert cache.JSON['bar'].get('en') == 'bar en'
-        assert cache.JSON['bar'].get('fr') == 'bar fr'
+        assert cache.JSON['bar'].get() == 'bar json'
+
+    def test_json_cache_stale(self):
+        """Confirms that the JSON from before a flush can be served while it
+        is rebuilt."""
+        etag = cache.JSON['foo'].set('old json', 1)
+        assert cache.JSON['foo'].get_with_etag() == (etag, 'old json')
+
+        cache.JSON['foo'].flush()
+        assert cache.JSON['foo'].get_with_etag() == (None, None)
+        assert cache.JSON['foo'].get_with_etag(stale=True) == (
+            etag, 'old json')
+
+        cache.JSON['foo'].set('new json', 2)
+        assert cache.JSON['foo'].get_with_etag(stale=True)[1] == 'new json'
+
+    def test_json_cache_set_after_flush(self):
+        """Confirms that JSON rendered before a flush is not served after
+        it, when set with the generation read before rendering."""
+        generation = cache.JSON['foo'].get_generation()
+        cache.JSON['foo'].flush()
+        cache.JSON['foo'].set('old json', 1, generation)
+        assert cache.JSON['foo'].get() == None
+
+
+class JsonFragmentCacheTest(MediumTestCase):
+    def setUp(self):
+        MediumTestCase.setUp(self)
+        cache.JSON_FRAGMENTS.flush()
+
+    def tearDown(self):
+        cache.JSON_FRAGMENTS.flush()
+
+    def test_json_fragment_cache(self):
+        """Confirms that the JsonFragmentCache works as expected."""
+        fragments = cache.JSON_FRAGMENTS['foo']
+        assert fragments.get_multi('layout1', {'a': 'a1', 'b': 'b1'}) == {}
+
+        fragments.set_multi('layout1', {'a': ('a1', '{"name": "a"}'),
+                                        'b': ('b1', '{"name": "b"}')})
+        assert fragments.get_multi(
+            'layout1', {'a': 'a1', 'b': 'b1', 'c': 'c1'}) == {
+            'a': '{"name": "a"}', 'b': '{"name": "b"}'}
+
+        # fragments for a different layout are misses
+        assert fragments.get_multi('layout2', {'a': 'a1', 'b': 'b1'}) == {}
+
+        # fragments encoded from other values of a subject are misses
+        assert fragments.get_multi('layout1', {'a': 'a2', 'b': 'b1'}) == {
+            'b': '{"name": "b"}'}
+
+        # other subdomain should be unaffected by a flush
+        cache.JSON_FRAGMENTS['bar'].set_multi('layout1', {'a': ('a1', 'bar a')})
+        fragments.flush()
+        assert fragments.get_multi('layout1', {'a': 'a1', 'b': 'b1'}) == {}
+        assert cache.JSON_FRAGMENTS['bar'].get_multi(
+            'layout1', {'a': 'a1'}) == {'a': 'bar a'}
+
+
+class MinimalSubjectCacheTest(MediumTestCase):
+    def setUp(self):
+        MediumTestCase.setUp(self)
+        subject = Subject.create('haiti', 'hospital', 'example.org/123', None)
+        self.minimal_subject = MinimalSubject.create(subject)
+        self.minimal_subject.set_attribute('title', u'H\xf4pital')
+        self.minimal_subject.set_attribute(
+            'location', db.GeoPt(18.5, -72.3))
+        self.minimal_subject.set_attribute('services', ['X_RAY', 'DIALYSIS'])
+        self.minimal_subject.set_attribute(
+            'updated', datetime.datetime(2010, 2, 3, 4, 5, 6, 7))
+        db.put([subject, self.minimal_subject])
+        cache.MINIMAL_SUBJECTS.flush()
+
+    def tearDown(self):
+        cache.MINIMAL_SUBJECTS.flush()
+        db.delete([self.minimal_subject, self.minimal_subject.parent_key()])
+
+    def test_minimal_subject_cache(self):
+        """Confirms that MinimalSubjects survive a round trip through the
+        compact records stored in memcache."""
+        minimal_subjects = cache.MINIMAL_SUBJECTS['haiti']
+        for record in [minimal_subjects['example.org/123'],
+                       minimal_subjects.decode_entities(
+                           minimal_subjects.encode_entities(
+                               minimal_subjects.entities))['example.org/123']]:
+            assert record.subdomain == 'haiti'
+            assert record.get_name() == 'example.org/123'
+            assert record.type == 'hospital'
+            assert record.key() == self.minimal_subject.key()
+            assert record.get_value('title') == u'H\xf4pital'
+            assert record.get_value('location') == db.GeoPt(18.5, -72.3)
+            assert record.get_value('services') == ['X_RAY', 'DIALYSIS']
+            assert record.get_value('updated') == datetime.datetime(
+                2010, 2, 3, 4, 5, 6, 7)
+            assert record.has_value('title')
+            assert not record.has_value('phone')
+            assert record.get_value('phone', 'none') == 'none'
+
+    def test_minimal_subject_cache_lease(self):
+        """Confirms that while another request holds the lease to rebuild
+        the cache, the MinimalSubjects from before the flush are not used."""
+        minimal_subjects = cache.MINIMAL_SUBJECTS['haiti']
+        assert minimal_subjects['example.org/123'].get_value(
+            'title') == u'H\xf4pital'
+        self.minimal_subject.set_attribute('title', u'H\xf4pital 2')
+        self.minimal_subject.put()
+        minimal_subjects.flush()
+        memcache.add(minimal_subjects.get_memcache_key(
+            cache.get_generation(minimal_subjects.name)) + '.lease', 1)
+
+        wait_seconds = cache.LEASE_WAIT_SECONDS
+        cache.LEASE_WAIT_SECONDS = 0
+        try:
+            assert minimal_subjects['example.org/123'].get_value(
+                'title') == u'H\xf4pital 2'
+        finally:
+            cache.LEASE_WAIT_SECONDS = wait_seconds
+        assert minimal_subjects.generation is not None
+
+    def test_minimal_subject_stamp(self):
+        """Confirms that a MinimalSubjectRecord's stamp survives a round trip
+        through memcache, and changes when a value changes."""
+        minimal_subjects = cache.MINIMAL_SUBJECTS['haiti']
+        stamp = minimal_subjects['example.org/123'].get_stamp()
+        assert minimal_subjects.decode_entities(
+            minimal_subjects.encode_entities(minimal_subjects.entities))[
+            'example.org/123'].get_stamp() == stamp
+
+        self.minimal_subject.set_attribute('title', u'H\xf4pital 2')
+        self.minimal_subject.put()
+        minimal_subjects.flush()
+        assert minimal_subjects['example.org/123'].get_stamp() != stamp
+
+
+class SubjectCacheTest(MediumTestCase):
+    def setUp(self):
+        MediumTestCase.setUp(self)
+        self.subject = Subject.create(
+            'haiti', 'hospital', 'example.org/1', None)
+        self.subject.set_attribute('title', 'foo', None, None, None, None, None)
+        self.subject.put()
+        cache.SUBJECTS.flush()
+
+    def tearDown(self):
+        cache.SUBJECTS.flush()
+        db.delete(self.subject)
+
+    def test_subject_cache(self):
+        """Confirms that Subjects are memoized, cached in memcache, and
+        written through."""
+        subject = cache.SUBJECTS.get('haiti', 'example.org/1')
+        assert subject.get_value('title') == 'foo'
+        assert cache.SUBJECTS.get('haiti', 'example.org/1') is subject
+        assert cache.SUBJECTS.get('haiti', 'example.org/2') == None
+
+        # A new request reads the Subject from memcache.
+        cache.SUBJECTS.flush_local()
+        db.delete(self.subject)
+        subjects = cache.SUBJECTS.get_multi_by_key_name(
+            ['haiti:example.org/1', 'haiti:example.org/2'])
+        assert subjects['haiti:example.org/1'].get_value('title') == 'foo'
+        assert subjects['haiti:example.org/2'] == None
+
+        # Writing through replaces the Subject in memcache.
+        self.subject.set_attribute('title', 'bar', None, None, None, None, None)
+        self.subject.put()
+        cache.SUBJECTS.set(self.subject)
+        cache.SUBJECTS.flush_local()
+        subject = cache.SUBJECTS.get('haiti', 'example.org/1')
+        assert subject.get_value('title') == 'bar'
+
+        cache.SUBJECTS.delete('haiti', 'example.org/1')
+        db.delete(self.subject)
+        assert cache.SUBJECTS.get('haiti', 'example.org/1') == None
+
+    def test_subject_cache_set_local(self):
+        """Confirms that set_local puts a Subject in the memo only."""
+        assert cache.SUBJECTS.get('haiti', 'example.org/1').get_value(
+            'title') == 'foo'
+        self.subject.set_attribute('title', 'bar', None, None, None, None, None)
+        cache.SUBJECTS.set_local(self.subject)
+        assert cache.SUBJECTS.get('haiti', 'example.org/1') is self.subject
+        cache.SUBJECTS.flush_local()
+        assert cache.SUBJECTS.get('haiti', 'example.org/1').get_value(
+            'title') == 'foo'
+
+
+
+class AccountIndexTest(MediumTestCase):
+    def setUp(self):
+        MediumTestCase.setUp(self)
+        self.account = Account(email='test@example.com', user_id='test',
+                               token='token_foo', actions=['*:view'])
+        self.account.put()
+        cache.ACCOUNTS.flush()
+
+    def tearDown(self):
+        cache.ACCOUNTS.flush()
+        db.delete(Account.all(keys_only=True).fetch(10))
+
+    def test_account_index(self):
+        """Confirms that Accounts are found by each indexed property and
+        cached in memcache."""
+        for property, value in [('email', 'test@example.com'),
+                                ('user_id', 'test'), ('token', 'token_foo')]:
+            account = cache.ACCOUNTS.get(property, value)
+            assert account.key() == self.account.key()
+            assert account.actions == ['*:view']
+
+        # Later lookups are answered from memcache.
+        db.delete(self.account)
+        assert cache.ACCOUNTS.get('email', 'test@example.com').key() == \
+            self.account.key()
+        cache.ACCOUNTS.flush()
+        assert cache.ACCOUNTS.get('email', 'test@example.com') is None
+
+    def test_account_index_negative(self):
+        """Confirms that the absence of an Account is cached too, until the
+        Account is put and its entries are invalidated."""
+        assert cache.ACCOUNTS.get('email', 'other@example.com') is None
+        assert memcache.get(cache.ACCOUNTS.get_memcache_key(
+            cache.get_generation(cache.ACCOUNTS.name),
+            'email', 'other@example.com')) == ''
+
+        other = Account(email='other@example.com', actions=['*:view'])
+        other.put()
+        assert cache.ACCOUNTS.get('email', 'other@example.com') is None
+        cache.ACCOUNTS.invalidate(other)
+        assert cache.ACCOUNTS.get('email', 'other@example.com').key() == \
+            other.key()
+
+    def test_account_index_invalidate(self):
+        """Confirms that invalidate() removes the entries for every indexed
+        property of an Account."""
+        for property, value in [('email', 'test@example.com'),
+                                ('user_id', 'test'), ('token', 'token_foo')]:
+            assert cache.ACCOUNTS.get(property, value).actions == ['*:view']
+
+        self.account.actions.append('haiti:edit')
+        self.account.put()
+        for property, value in [('email', 'test@example.com'),
+                                ('user_id', 'test'), ('token', 'token_foo')]:
+            assert cache.ACCOUNTS.get(property, value).actions == ['*:view']
+
+        cache.ACCOUNTS.invalidate(self.account)
+        for property, value in [('email', 'test@example.com'),
+                                ('user_id', 'test'), ('token', 'token_foo')]:
+            assert cache.ACCOUNTS.get(property, value).actions == [
+                '*:view', 'haiti:edit']
+
+
+class FlushSubjectTest(MediumTestCase):
+    def setUp(self):
+        MediumTestCase.setUp(self)
+        self.subject = Subject.create(
+            'haiti', 'hospital', 'example.org/1', None)
+        self.subject.set_attribute('location', db.GeoPt(18.5, -72.3),
+                                   None, None, None, None, None)
+        self.subject.put()
+        cache.SUBJECTS.flush()
+
+    def tearDown(self):
+        cache.SUBJECTS.flush()
+        db.delete(self.subject)
+
+    def test_flush_subject(self):
+        """Confirms that flush_subject writes the Subject through to SUBJECTS,
+        and removes it from SUBJECTS when it was purged."""
+        cache.flush_subject('haiti', 'example.org/1', self.subject)
+        db.delete(self.subject)
+        cache.SUBJECTS.flush_local()
+        assert cache.SUBJECTS.get('haiti', 'example.org/1').get_value(
+            'location') == db.GeoPt(18.5, -72.3)
+
+        # A purged Subject is removed from SUBJECTS.
+        cache.flush_subject('haiti', 'example.org/1')
+        cache.SUBJECTS.flush_local()
+        assert cache.SUBJECTS.get('haiti', 'example.org/1') is None
+
+
+def get_memcached_messages():
+    """Gets the value of cache.MESSAGES in memcache, at its generation."""
+    return memcache.get(cache.MESSAGES.get_memcache_key(
+        cache.get_generation(cache.MESSAGES.name)))
 
 
 class CacheTest(MediumTestCase):
@@ -82,7 +375,7 @@ class CacheTest(MediumTestCase):
 
     def test_cache(self):
         """Confirms that the Cache works as expected using MessageCache."""
-        assert memcache.get(cache.MESSAGES.memcache_key) == None
+        assert get_memcached_messages() == None
         assert cache.MESSAGES.entities == None
 
         # Loads from the cache
@@ -93,15 +386,111 @@ class CacheTest(MediumTestCase):
 
         # Flush should clear out
         cache.MESSAGES.flush()
-        assert memcache.get(cache.MESSAGES.memcache_key) == None
+        assert get_memcached_messages() == None
         assert cache.MESSAGES.entities == None
 
         # Loads from the cache again
         assert cache.MESSAGES[key] != None
         assert cache.MESSAGES.entities != None
-        assert memcache.get(cache.MESSAGES.memcache_key) != None
+        assert get_memcached_messages() != None
 
         # Partial flush of in-memory cache only
         cache.MESSAGES.flush_local()
-        assert memcache.get(cache.MESSAGES.memcache_key) != None
+        assert get_memcached_messages() != None
         assert cache.MESSAGES.entities == None
+
+    def test_prefetch(self):
+        """Confirms that prefetch() loads missing and flushed caches."""
+        cache.prefetch('', ['MessageCache'])
+        entities = cache.MESSAGES.entities
+        assert len(entities) == 10
+        assert get_memcached_messages() != None
+
+        # Still valid, so the local entities are kept.
+        cache.prefetch('', ['MessageCache'])
+        assert cache.MESSAGES.entities is entities
+
+        # Simulate a flush on another instance.
+        cache.next_generation(cache.MESSAGES.name)
+        cache.prefetch('', ['MessageCache'])
+        assert cache.MESSAGES.entities is not entities
+        assert len(cache.MESSAGES.entities) == 10
+
+    def test_cache_group_eviction(self):
+        """Confirms that a CacheGroup flushes the least recently used caches
+        from local memory beyond its limit."""
+        group = cache.CacheGroup(cache.MessageCache, max_caches=2)
+        assert len(group['a']) == 10
+        assert len(group['b']) == 10
+        assert len(group['c']) == 10
+        assert group.caches['a'].entities == None
+        group.caches['a'].stats.flush()
+        assert cache.get_stats(group.caches['a'].name)['evictions'] == 1
+        assert group.caches['b'].entities != None
+
+        # Using 'b' again makes 'c' the least recently used.
+        assert len(group['b']) == 10
+        assert len(group['a']) == 10
+        assert group.caches['c'].entities == None
+        assert group.caches['b'].entities != None
+        for key in group.caches:
+            group.caches[key].flush()
+
+    def test_cache_lease(self):
+        """Confirms that while another request holds the lease to rebuild
+        the cache, the previous generation is served."""
+        assert len(cache.MESSAGES) == 10
+        generation = cache.get_generation(cache.MESSAGES.name)
+        Message(ns='english', name='name_10').put()
+        cache.MESSAGES.flush()
+        memcache.add(cache.MESSAGES.get_memcache_key(generation + 1) +
+                     '.lease', 1)
+
+        wait_seconds = cache.LEASE_WAIT_SECONDS
+        cache.LEASE_WAIT_SECONDS = 0
+        try:
+            assert len(cache.MESSAGES) == 10
+        finally:
+            cache.LEASE_WAIT_SECONDS = wait_seconds
+        self.messages.append(Message.all(keys_only=True).filter(
+            'name =', 'name_10').get())
+
+        # Once the lease is released, the next load rebuilds the cache.
+        memcache.delete(cache.MESSAGES.get_memcache_key(generation + 1) +
+                        '.lease')
+        cache.MESSAGES.flush_local()
+        assert len(cache.MESSAGES) == 11
+
+    def test_cache_lease_unavailable(self):
+        """Confirms that when the lease can't be taken but nobody holds it,
+        the cache is rebuilt without waiting for it."""
+        Message(ns='english', name='name_10').put()
+        self.messages.append(Message.all(keys_only=True).filter(
+            'name =', 'name_10').get())
+        add = memcache.add
+        memcache.add = lambda key, *args, **kwargs: (
+            not key.endswith('.lease') and add(key, *args, **kwargs))
+        wait_seconds = cache.LEASE_WAIT_SECONDS
+        cache.LEASE_WAIT_SECONDS = 60
+        try:
+            start = time.time()
+            assert len(cache.MESSAGES) == 11
+            assert time.time() - start < 10
+        finally:
+            memcache.add = add
+            cache.LEASE_WAIT_SECONDS = wait_seconds
+
+    def test_cache_stats(self):
+        """Confirms that lookups and loads are counted, and that the counts
+        and the size are written to memcache only when flushed."""
+        cache.flush_stats()
+        before = cache.get_stats(cache.MESSAGES.name)
+        assert len(cache.MESSAGES) == 10  # a miss and a load
+        assert len(cache.MESSAGES) == 10  # a local hit
+        assert cache.get_stats(cache.MESSAGES.name) == before
+        cache.flush_stats()
+        after = cache.get_stats(cache.MESSAGES.name)
+        for counter, n in [('misses', 1), ('loads', 1), ('local_hits', 1),
+                           ('hits', 1), ('memcache_hits', 0)]:
+            assert after.get(counter, 0) - before.get(counter, 0) == n
+        assert after['size'] > 0
@@ -0,0 +1,69 @@
+# Copyright 2010 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Handler for the map data payload.  With a 'since' parameter, returns just
+the subjects added, changed, or purged after that data version.  With
+'format=columnar', returns the full payload in the columnar format (see
+rendering.columnar_subjects_transformer)."""
+
+import rendering
+import utils
+from utils import ErrorMessage
+
+class Data(utils.Handler):
+    def get(self):
+        if not self.subdomain:
+            raise ErrorMessage(400, 'No subdomain specified.')
+
+        # Need 'view' permission to see the data.
+        self.require_action_permitted('view')
+
+        format = self.request.get('format')
+        if format not in ['', 'columnar']:
+            raise ErrorMessage(400, 'Invalid format.')
+
+        since = self.request.get('since')
+        if since:
+            try:
+                since = int(since)
+            except ValueError:
+                raise ErrorMessage(400, 'Invalid data version.')
+            json = rendering.render_delta_json(self.subdomain, since)
+        else:
+            # Serve the stored JSON, and nothing at all to clients that
+            # already have the data.
+            columnar = format == 'columnar'
+            etag, json = rendering.get_cached_json(
+                self.subdomain, columnar, stale=True)
+            if etag is None:
+                # Write the data out as it is encoded.  Its ETag is known
+                # once it has all been written.
+                self.set_content_headers()
+                etag, json = rendering.write_json(
+                    self.subdomain, self.write, columnar)
+                self.response.headers['ETag'] = etag
+                return
+            if self.check_etag(etag):
+                return
+
+        self.set_content_headers()
+        self.write(json)
+
+    def set_content_headers(self):
+        # The payload has unquoted keys, so it is JavaScript rather than JSON.
+        self.response.headers['Content-Type'] = 'text/javascript'
+        self.response.headers['Cache-Control'] = 'no-cache'
+
+if __name__ == '__main__':
+    utils.run([('/data', Data)], debug=True)
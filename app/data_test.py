@@ -0,0 +1,159 @@
+# Copyright 2010 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for data.py."""
+
+import webob
+
+from google.appengine.ext import db, webapp
+
+import cache
+import data
+import rendering
+from medium_test_case import MediumTestCase
+from model import Account, Attribute, DataVersion, MinimalSubject, Subject
+from model import SubjectChange, SubjectType
+
+class DataTest(MediumTestCase):
+    def setUp(self):
+        MediumTestCase.setUp(self)
+        subject_type = SubjectType.create('haiti', 'hospital')
+        subject_type.attribute_names = ['title']
+        subject_type.minimal_attribute_names = ['title']
+        self.subject = Subject.create(
+            'haiti', 'hospital', 'example.org/1', None)
+        self.subject.set_attribute(
+            'title', 'foo', None, None, None, None, None)
+        self.minimal_subject = MinimalSubject.create(self.subject)
+        self.minimal_subject.set_attribute('title', 'foo')
+        self.entities = [
+            Account(key_name='default', actions=['*:view']),
+            Attribute(key_name='title', type='str'),
+            subject_type, self.subject, self.minimal_subject]
+        db.put(self.entities)
+        cache.flush_all()
+
+    def tearDown(self):
+        db.delete(self.entities)
+        cache.flush_all()
+
+    def simulate_request(self, path, **headers):
+        request = webapp.Request(webob.Request.blank(path).environ)
+        for name, value in headers.items():
+            request.headers[name.replace('_', '-')] = value
+        response = webapp.Response()
+        handler = data.Data()
+        handler.initialize(request, response, None)
+        handler.get()
+        return handler
+
+    def test_etag(self):
+        """Confirms that the data is served with an ETag, and that a client
+        that already has the data gets a 304 with no body."""
+        # The first request renders the data as it is written out.
+        handler = self.simulate_request('/data?subdomain=haiti')
+        etag = handler.response.headers['ETag']
+        assert etag
+        assert '"foo"' in handler.response.out.getvalue()
+
+        # The next request is served from the cache with the same ETag.
+        handler = self.simulate_request('/data?subdomain=haiti')
+        assert handler.response.headers['ETag'] == etag
+        assert '"foo"' in handler.response.out.getvalue()
+
+        handler = self.simulate_request(
+            '/data?subdomain=haiti', If_None_Match=etag)
+        assert handler.response.status == 304
+        assert handler.response.out.getvalue() == ''
+
+        handler = self.simulate_request(
+            '/data?subdomain=haiti', If_None_Match='"other", ' + etag)
+        assert handler.response.status == 304
+
+        # A change to the data changes the ETag, once the data is rebuilt
+        # (until then, the data from before the change is served).
+        self.minimal_subject.set_attribute('title', 'bar')
+        self.minimal_subject.put()
+        cache.flush_subject('haiti', 'example.org/1', self.subject)
+        rendering.write_json('haiti')
+        handler = self.simulate_request(
+            '/data?subdomain=haiti', If_None_Match=etag)
+        assert handler.response.status == 200
+        assert handler.response.headers['ETag'] != etag
+        assert '"bar"' in handler.response.out.getvalue()
+
+    def get_layout(self):
+        attributes, subject_types, attribute_jobjects, subject_type_jobjects, \
+            subject_type_is = rendering.get_layout('haiti')
+        return rendering.get_layout_version(
+            attribute_jobjects, subject_type_jobjects)
+
+    def test_layout(self):
+        """Confirms that the full data includes the layout version."""
+        handler = self.simulate_request('/data?subdomain=haiti')
+        assert 'layout: "%s"' % self.get_layout() in \
+            handler.response.out.getvalue()
+
+    def test_delta(self):
+        """Confirms that a request with 'since' gets just the changes after
+        the given version, with the layout version of their indexes."""
+        assert SubjectChange.record('haiti', 'example.org/1') == 1
+
+        handler = self.simulate_request('/data?subdomain=haiti&since=0')
+        json = handler.response.out.getvalue()
+        assert 'version: 1' in json
+        assert 'layout: "%s"' % self.get_layout() in json
+        assert 'name: "example.org/1"' in json
+        assert '"foo"' in json
+        assert 'purged: []' in json
+
+        handler = self.simulate_request('/data?subdomain=haiti&since=1')
+        json = handler.response.out.getvalue()
+        assert 'version: 1' in json
+        assert 'subjects: []' in json
+
+        handler = self.simulate_request('/data?subdomain=haiti&since=x')
+        assert handler.response.status == 400
+
+    def test_render_delta_json(self):
+        """Confirms that render_delta_json reports each Subject's latest
+        change, in the order the versions were given out."""
+        assert SubjectChange.record('haiti', 'example.org/2', True) == 1
+        assert SubjectChange.record('haiti', 'example.org/1') == 2
+        assert DataVersion.get_version('haiti') == 2
+
+        # The changes are stored in the entity group of the DataVersion.
+        for change in SubjectChange.all_since('haiti', 0):
+            assert change.parent_key() == DataVersion.get_key('haiti')
+        assert [change.subject_name for change in
+                SubjectChange.all_since('haiti', 0)] == [
+            'example.org/2', 'example.org/1']
+
+        json = rendering.render_delta_json('haiti', 0)
+        assert 'version: 2' in json
+        assert 'name: "example.org/1"' in json
+        assert 'purged: ["example.org/2"]' in json
+
+        json = rendering.render_delta_json('haiti', 1)
+        assert 'version: 2' in json
+        assert 'name: "example.org/1"' in json
+        assert 'purged: []' in json
+
+        # A later change to the same Subject replaces the earlier one.
+        assert SubjectChange.record('haiti', 'example.org/1') == 3
+        assert [change.version for change in
+                SubjectChange.all_since('haiti', 0)] == [1, 3]
+        json = rendering.render_delta_json('haiti', 2)
+        assert 'version: 3' in json
+        assert 'name: "example.org/1"' in json
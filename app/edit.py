@@ -322,7 +322,8 @@ def update(subject_name, subject_type, request, user, account, attributes,
     """Given a subject name, subject type, and request information from the
     edit page, this updates or creates the subject as requested (i.e. adds a
     Report and updates or creates the Subject and MinimalSubject with the
-    latest values).  Also queues a task to send out any relevant mail alerts.
+    latest values).  Also queues tasks to send out any relevant mail alerts
+    and to record the change for the delta clients.
 
     Args:
         key: key_name of the potentially changed subject
@@ -335,11 +336,13 @@ def update(subject_name, subject_type, request, user, account, attributes,
         new: (optional) True if this update is for a new subject
         transactional: (optional) True if this function is being run in
             transaction
+
+    Returns:
+        The Subject if it was created or changed, otherwise None.
     """
-    subject = model.Subject.get(subdomain, subject_name)
-    if subject:
-        minimal_subject = model.MinimalSubject.get_by_subject(subject)
-    else:
+    subject, minimal_subject = model.Subject.get_pairs(
+        subdomain, [subject_name])[0]
+    if not subject:
         # Create a new subject.
         subject = model.Subject.create(
             subdomain, subject_type, subject_name, user)
@@ -390,9 +393,8 @@ def update(subject_name, subject_type, request, user, account, attributes,
     
     if changed_attribute_information:
         # Store the changes.
+        minimal_subject.last_updated = subject.last_updated
         db.put([report, subject, minimal_subject])
-        cache.MINIMAL_SUBJECTS[subdomain].flush()
-        cache.JSON[subdomain].flush()
         
         params = {
             'subdomain': subdomain,
@@ -414,6 +416,10 @@ def update(subject_name, subject_type, request, user, account, attributes,
         # Schedule a task to add an entry to the delta feed.
         taskqueue.add(method='POST', url='/tasks/add_delta_entry',
                       params=params, transactional=transactional)
+        model.SubjectChange.queue_record(
+            subdomain, subject.name, transactional=transactional)
+        return subject
+    return None
 
 
 # ==== Handler for the edit page =============================================
@@ -445,7 +451,7 @@ class Edit(utils.Handler):
         else:
             # Need 'edit' permission to see or submit the edit form.
             self.require_action_permitted('edit')
-            self.subject = model.Subject.get(
+            self.subject = cache.SUBJECTS.get(
                 self.subdomain, self.params.subject_name)
             if not self.subject:
                 #i18n: Error message for request missing subject name.
@@ -526,6 +532,7 @@ class Edit(utils.Handler):
             self.account.affiliation = affiliation.strip()
             self.account.actions.append('edit')
             self.account.put()
+            cache.ACCOUNTS.invalidate(self.account)
             logging.info('Assigning nickname "%s" and affiliation "%s" to %s'
                          % (nickname, affiliation, self.account.email))
 
@@ -540,14 +547,12 @@ class Edit(utils.Handler):
         else:
             subject_name = model.Subject.generate_name(
                 self.request.headers['Host'], self.subject_type)
-        db.run_in_transaction(update, subject_name, self.subject_type,
-                              self.request, self.user, self.account,
-                              attributes, self.subdomain,
-                              new=bool(self.params.add_new))
-        # Fire off a task to asynchronously refresh the JSON cache
-        # and reduce the latency of the next page load.
-        taskqueue.add(url='/refresh_json_cache?lang=%s&subdomain=%s'
-                      % (self.params.lang, self.subdomain), method='GET')
+        subject = db.run_in_transaction(
+            update, subject_name, self.subject_type, self.request, self.user,
+            self.account, attributes, self.subdomain,
+            new=bool(self.params.add_new))
+        if subject:
+            cache.flush_subject(self.subdomain, subject_name, subject)
         if self.params.embed:
             if self.params.add_new:
                 # Send edit.js the new subject's name so it can auto select it
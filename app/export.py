@@ -194,7 +194,7 @@ def write_kml(out, subdomain, type_name, icon_url, now, render_to_string):
             (special, general, details) = value_info_extractor.extract(
                 subject, subject_type.attribute_names)
             attributes_by_title_and_name[(title, subject.get_name())] = (
-                special, general, max(detail.date for detail in details))
+                special, general, utils.format(get_last_updated_time(subject)))
         subject_query.with_cursor(subject_query.cursor())
         subjects = subject_query.fetch(batch_size)
     subdomain_cap = to_utf8(subdomain[0].upper() + subdomain[1:])
@@ -217,7 +217,7 @@ def write_kmz(out, subdomain, type_name, render_to_string):
        in kmz format, with a placemark for each subject"""
     # TODO(shakusa) Because this is so slow, it probably makes sense to cache
     # the result in memcache by (subdomain, type_name, lang), purge it when
-    # editing, and reload like refresh_json_cache does
+    # editing, and rebuild it in the background like cache.JsonCache does
 
     kml_out = StringIO.StringIO()
     now = to_local_isotime(datetime.datetime.now(), True)
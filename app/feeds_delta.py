@@ -52,11 +52,11 @@ def update_subject(subject, observed, account, source_url, values, comments={},
     affiliation = account.affiliation
 
     # The real work happens here.
-    def work(key):
+    def work(subdomain, subject_name):
         # We want to transactionally update the Report, Subject, and
         # MinimalSubject, so reload the Subject inside the transaction.
-        subject = db.get(key)
-        minimal_subject = model.MinimalSubject.get_by_subject(subject)
+        subject, minimal_subject = model.Subject.get_pairs(
+            subdomain, [subject_name])[0]
 
         # Create an empty Report.
         report = model.Report(
@@ -84,13 +84,18 @@ def update_subject(subject, observed, account, source_url, values, comments={},
         # Store the new Report.
         db.put(report)
 
-        # If the Subject has been modified, store it and flush the cache.
+        # If the Subject has been modified, store it.
         if subject_changed:
+            minimal_subject.last_updated = subject.last_updated
             db.put([subject, minimal_subject])
-            cache.MINIMAL_SUBJECTS[subject.subdomain].flush()
-            cache.JSON[subject.subdomain].flush()
+            model.SubjectChange.queue_record(subdomain, subject_name)
+            return subject
+        return None
 
-    db.run_in_transaction(work, subject.key())
+    updated_subject = db.run_in_transaction(
+        work, subject.subdomain, subject.name)
+    if updated_subject:
+        cache.flush_subject(subject.subdomain, subject.name, updated_subject)
 
 
 class Feed(Handler):
@@ -148,7 +153,7 @@ class Feed(Handler):
                 user=None, affiliation='', nickname=entry.author_uri)
             row = xml_utils.parse(entry.content)
             values, comments = row_utils.parse_from_elements(row)
-            subject = model.Subject.get(self.subdomain, entry.subject_id)
+            subject = cache.SUBJECTS.get(self.subdomain, entry.subject_id)
             if subject:
                 try:
                     update_subject(subject, entry.observed, account,
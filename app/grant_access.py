@@ -25,6 +25,7 @@ Handler for allowing an Account with 'grant' permission to grant access using
 the permission scheme provided in access.py
 """
 
+import cache
 import logging
 import model
 import utils
@@ -81,6 +82,7 @@ class GrantAccess(utils.Handler):
         if grant == 'approve':
             account.actions.append(action)
         account.put()
+        cache.ACCOUNTS.invalidate(account)
         logging.info('%s request for %s was %s' % (account.email,
                                                    action,
                                                    grant))
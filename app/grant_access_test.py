@@ -0,0 +1,69 @@
+# Copyright 2010 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests for grant_access.py."""
+
+import webob
+
+from google.appengine.ext import db, webapp
+
+import cache
+import grant_access
+from medium_test_case import MediumTestCase
+from model import Account
+from utils import Redirect, users
+
+class GrantAccessTest(MediumTestCase):
+    def setUp(self):
+        MediumTestCase.setUp(self)
+        self.user = users.User('admin@example.com')
+        self.admin = Account(email='admin@example.com', actions=['*:grant'])
+        self.account = Account(email='test@example.com', actions=['*:view'],
+                               requested_actions=['edit', 'add'])
+        db.put([self.admin, self.account])
+        cache.ACCOUNTS.flush()
+
+    def tearDown(self):
+        db.delete([self.admin, self.account])
+        cache.ACCOUNTS.flush()
+
+    def simulate_request(self, path):
+        request = webapp.Request(webob.Request.blank(path).environ)
+        response = webapp.Response()
+        handler = grant_access.GrantAccess()
+        handler.initialize(request, response, self.user)
+        return handler
+
+    def test_grant_invalidates_account(self):
+        """Confirms that granting or denying a request invalidates the cached
+        Account of the user who made it."""
+        assert cache.ACCOUNTS.get('email', 'test@example.com').actions == [
+            '*:view']
+
+        handler = self.simulate_request(
+            '/grant_access?subdomain=haiti&action=edit&grant=approve&key=%s'
+            % self.account.key())
+        self.assertRaises(Redirect, handler.post)
+        account = cache.ACCOUNTS.get('email', 'test@example.com')
+        assert account.actions == ['*:view', 'edit']
+        assert account.requested_actions == ['add']
+
+        handler = self.simulate_request(
+            '/grant_access?subdomain=haiti&action=add&grant=deny&key=%s'
+            % self.account.key())
+        self.assertRaises(Redirect, handler.post)
+        account = cache.ACCOUNTS.get('email', 'test@example.com')
+        assert account.actions == ['*:view', 'edit']
+        assert account.requested_actions == []
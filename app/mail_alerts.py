@@ -49,7 +49,7 @@ import cache
 import model
 import utils
 from feedlib.xml_utils import Struct
-from model import Account, PendingAlert, Subject, Subscription
+from model import Account, PendingAlert, Subscription
 from utils import _, format, get_last_updated_time, order_and_format_updates
 
 # Set up localization.
@@ -216,9 +216,11 @@ class EmailFormatter:
                      'author': author_foo}))})
         """
         body = u''
+        subjects = cache.SUBJECTS.get_multi_by_key_name(
+            data.changed_subjects.keys())
         for subject_name in data.changed_subjects:
             (subject_title, updates) = data.changed_subjects[subject_name]
-            subject = Subject.get_by_key_name(subject_name)
+            subject = subjects[subject_name]
             subdomain = subject.get_subdomain()
             subject_type = cache.SUBJECT_TYPES[subdomain][subject.type]
             updates = order_and_format_updates(updates, subject_type,
@@ -262,8 +264,10 @@ class HospitalEmailFormatter(EmailFormatter):
             [ subject_name1, subject_name2, subject_name3, ... ]
         """
         changed_subjects = []
+        subjects = cache.SUBJECTS.get_multi_by_key_name(
+            data.changed_subjects.keys())
         for subject_name in data.changed_subjects:
-            subject = Subject.get_by_key_name(subject_name)
+            subject = subjects[subject_name]
             subdomain, no_subdomain_name = subject_name.split(':')
             subject_type = cache.SUBJECT_TYPES[subdomain][subject.type]
             updates = order_and_format_updates(
@@ -385,7 +389,13 @@ class MailAlerts(utils.Handler):
         users who were subscribed to instant updates for this particular
         subject.
         """
-        subject = Subject.get(self.subdomain, self.params.subject_name)
+        # This task is queued in the transaction that changed the Subject,
+        # so it can run before the Subject is written through to SUBJECTS.
+        # Read the Subject from the datastore, and have the e-mail formatters
+        # (which look in SUBJECTS) use this copy.
+        subject = model.Subject.get(self.subdomain, self.params.subject_name)
+        if subject:
+            cache.SUBJECTS.set_local(subject)
         subject_key_name = self.subdomain + ':' + self.params.subject_name
         subscriptions = Subscription.get_by_subject(subject_key_name)
         for subscription in subscriptions:
@@ -447,9 +457,12 @@ class MailAlerts(utils.Handler):
             alerts_to_delete = []
             unchanged_subjects = []
             changed_subjects = {}
-            for subscription in Subscription.all().filter('user_email =',
-                account.email).filter('frequency =', frequency):
-                subject = Subject.get_by_key_name(subscription.subject_name)
+            subscriptions = list(Subscription.all().filter(
+                'user_email =', account.email).filter('frequency =', frequency))
+            subjects = cache.SUBJECTS.get_multi_by_key_name(
+                [subscription.subject_name for subscription in subscriptions])
+            for subscription in subscriptions:
+                subject = subjects[subscription.subject_name]
                 pa = PendingAlert.get(frequency, account.email,
                                       subscription.subject_name)
                 if pa:
@@ -483,6 +496,7 @@ class MailAlerts(utils.Handler):
                 update_account_alert_time(account, frequency)
                 db.delete(alerts_to_delete)
                 db.put(account)
+                cache.ACCOUNTS.invalidate(account)
             except OverQuotaError, message:
                 # Throw the error here in order to avoid mass duplication of
                 # the mail alerts task. If you let the system automatically
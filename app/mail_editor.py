@@ -107,8 +107,8 @@ def update_subject(subject, observed, account, source_url, values, comments={},
     def work(transactional=True):
         # We want to transactionally update the Report, Subject, and
         # MinimalSubject, so reload the Subject inside the transaction.
-        subject = model.Subject.get(subdomain, subject_name)
-        minimal_subject = model.MinimalSubject.get_by_subject(subject)
+        subject, minimal_subject = model.Subject.get_pairs(
+            subdomain, [subject_name])[0]
 
         # Create an empty Report.
         report = model.Report(
@@ -150,11 +150,10 @@ def update_subject(subject, observed, account, source_url, values, comments={},
         # Store the new Report.
         db.put(report)
 
-        # If the Subject has been modified, store it and flush the cache.
+        # If the Subject has been modified, store it.
         if subject_changed:
+            minimal_subject.last_updated = subject.last_updated
             db.put([subject, minimal_subject])
-            cache.MINIMAL_SUBJECTS[subdomain].flush()
-            cache.JSON[subdomain].flush()
 
             params = {
                 'subdomain': subdomain,
@@ -170,8 +169,14 @@ def update_subject(subject, observed, account, source_url, values, comments={},
             # subject.
             taskqueue.add(method='POST', url='/mail_alerts',
                           params=params, transactional=transactional)
+            model.SubjectChange.queue_record(
+                subdomain, subject_name, transactional=transactional)
+            return subject
+        return None
 
-    db.run_in_transaction(work)
+    updated_subject = db.run_in_transaction(work)
+    if updated_subject:
+        cache.flush_subject(subdomain, subject_name, updated_subject)
 
 
 def find_attribute_value(attribute, update_text):
@@ -371,6 +376,7 @@ class MailEditor(InboundMailHandler):
             template on how to update subjects
     """
     def init(self, message):
+        cache.SUBJECTS.flush_local()
         self.domain = 'http://%s' % self.request.headers['Host']
         # Pulls out the email address from any string
         self.email = match_email(message.sender)
@@ -415,6 +421,7 @@ class MailEditor(InboundMailHandler):
                 self.account.nickname = nickname
                 self.account.affiliation = affiliation
                 db.put(self.account)
+                cache.ACCOUNTS.invalidate(self.account)
                 return self.account
 
     def receive(self, message):
@@ -480,7 +487,7 @@ class MailEditor(InboundMailHandler):
                              flags=self.update_line_flags)
         if key_match:
             subject_name = key_match.group('subject_name')
-            return model.Subject.get(self.subdomain, subject_name)
+            return cache.SUBJECTS.get(self.subdomain, subject_name)
         else:
             title_lower = subject_line.strip().lower()
             minimal_subjects = get_min_subjects_by_lowercase_title(
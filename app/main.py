@@ -17,6 +17,8 @@ from google.appengine.api import users
 import access
 import cache
 import config
+import hashlib
+import os
 import model
 import rendering
 import utils
@@ -68,6 +70,21 @@ class Main(utils.Handler):
         #     self.response.headers.add_header('Set-Cookie', 'visited=yes')
         first_visit = False
 
+        # The full map page is rendered from the cached data, so a client
+        # that already has the page for the current data can reuse it.
+        # The data from before the last change may be served while it is
+        # rebuilt in the background; the page polls for changes anyway.
+        if center:
+            data = rendering.render_json(
+                self.subdomain, center, self.params.rad)
+        else:
+            data_etag, data = rendering.get_cached_json(
+                self.subdomain, stale=True)
+            if not data_etag:
+                data_etag, data = rendering.write_json(self.subdomain)
+            if self.check_etag(self.get_page_etag(data_etag)):
+                return
+
         self.render(template,
                     params=self.params,
                     user=user,
@@ -78,8 +95,7 @@ class Main(utils.Handler):
                     loginout_text=(user and _('Sign out')
                                    #i18n: Link to sign into the app
                                    or _('Sign in')),
-                    data=rendering.render_json(
-                        self.subdomain, center, self.params.rad),
+                    data=data,
                     home_url=home_url,
                     feedback_url=feedback_url,
                     settings_url=settings_url,
@@ -87,6 +103,13 @@ class Main(utils.Handler):
                     export_url=self.get_export_url(),
                     print_url=self.get_url('/?print=yes'),
                     bubble_url=self.get_url('/bubble'),
+                    # Clients showing a radius around a center or printing
+                    # don't poll for changes.
+                    data_url=not (center or is_print) and
+                        self.get_url('/data') or '',
+                    messages_url=self.get_url(
+                        '/messages', lang=self.params.lang,
+                        version=cache.MESSAGES.get_version()),
                     embed_url=self.get_url('/embed'),
                     disable_iframe_url=self.get_url('/', iframe='no'),
                     edit_url_template=self.get_url('/edit', embed='yes')
@@ -97,6 +120,21 @@ class Main(utils.Handler):
                         self.subdomain],
                     first_visit=first_visit)
 
+    def get_page_etag(self, data_etag):
+        """Gets an ETag for the main page, which depends on the data, the
+        messages, the deployed version of the app, the URL, and the user's
+        permissions."""
+        account = self.account
+        return '"%s"' % hashlib.md5(repr([
+            data_etag,
+            cache.MESSAGES.get_version(),
+            os.environ.get('CURRENT_VERSION_ID', ''),
+            self.request.url,
+            self.user and self.user.email(),
+            account and account.actions,
+            access.get_default_permissions()
+        ])).hexdigest()
+
     def get_export_url(self):
         """If only one subject type, return the direct download link URL,
         otherwise return a link to the download page"""
@@ -0,0 +1,44 @@
+# Copyright 2010 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Handler for the bundle of translated messages for a language, as a script
+that sets the 'messages' variable in map.js.  Pages refer to the bundle with
+the current 'version' (see cache.MessageCache.get_version), so a bundle at a
+given URL never changes and can be cached for a long time."""
+
+import cache
+import rendering
+import utils
+
+# Maximum age in seconds for clients to cache a bundle of the current version.
+MAX_AGE = 365*24*3600
+
+class Messages(utils.Handler):
+    lang_cookie = False  # the response is cached publicly
+
+    def get(self):
+        # Messages are public (they are the same for all subdomains), so no
+        # permission is needed to see them.
+        if self.request.get('version') == cache.MESSAGES.get_version():
+            cache_control = 'public, max-age=%d' % MAX_AGE
+        else:
+            # Don't let a stale version's URL cache the current messages.
+            cache_control = 'no-cache'
+        self.response.headers['Content-Type'] = 'text/javascript'
+        self.response.headers['Cache-Control'] = cache_control
+        self.write('messages = %s;' %
+                   rendering.render_messages_json(utils.get_locale()))
+
+if __name__ == '__main__':
+    utils.run([('/messages', Messages)], debug=True)
@@ -37,10 +37,14 @@ This project uses the following naming conventions in variables and properties:
 
 import datetime
 
+from google.appengine.api import taskqueue
 from google.appengine.ext import db
 
 MAX_DATE = datetime.datetime(datetime.MAXYEAR, 1, 1)
 
+# Number of IDs that UniqueId.create_id reserves at a time.
+UNIQUE_ID_BLOCK_SIZE = 100
+
 class Subdomain(db.Model):
     """A separate grouping of Subjects and SubjectTypes.  Top-level entity,
     with no parent.  Key name: unique subdomain name.  In the UI, each
@@ -114,6 +118,10 @@ class Subject(SubdomainMixin, db.Expando):
     type = db.StringProperty(required=True)  # key_name of a SubjectType,
                                              # without the subdomain prefix
     author = db.UserProperty()  # who created this Subject
+    # latest observed time of any attribute value (maintained by
+    # set_attribute; missing on Subjects that predate it, see
+    # backfill_last_updated.py)
+    last_updated = db.DateTimeProperty()
     # additional properties for the current value of each attribute
     # (named by Attribute's key_name).  This denormalization is for read speed.
     # Consider an attribute named 'foo'. We will store 6 values here:
@@ -137,6 +145,23 @@ class Subject(SubdomainMixin, db.Expando):
         return Subject(key_name='%s:%s' % (subdomain, subject_name),
                        type=get_name(subject_type_or_type_name), author=author)
 
+    @staticmethod
+    def get_key(subdomain, subject_name):
+        """Gets the key of the Subject with the given subdomain and name."""
+        return db.Key.from_path('Subject', subdomain + ':' + subject_name)
+
+    @staticmethod
+    def get_pairs(subdomain, subject_names):
+        """Gets the Subjects with the given names and their MinimalSubjects
+        in one datastore call.  Returns a list of (Subject, MinimalSubject)
+        pairs in the order of the names, with None for missing entities."""
+        keys = []
+        for subject_name in subject_names:
+            keys.append(Subject.get_key(subdomain, subject_name))
+            keys.append(MinimalSubject.get_key(subdomain, subject_name))
+        entities = db.get(keys)
+        return zip(entities[0::2], entities[1::2])
+
     @staticmethod
     def generate_name(host, subject_type_or_type_name):
         """Makes a new unique subject_name for an original subject (originally
@@ -151,8 +176,8 @@ class Subject(SubdomainMixin, db.Expando):
     @classmethod
     def delete_complete(cls, subject): 
         if subject:
-            minimal_subject = MinimalSubject.get_by_subject(subject)
-            db.delete([subject, minimal_subject])
+            db.delete([subject, MinimalSubject.get_key(
+                subject.subdomain, subject.name)])
 
     def has_value(self, attribute_name):
         """Returns the value of the Attribute with the given key_name,
@@ -189,11 +214,25 @@ class Subject(SubdomainMixin, db.Expando):
            given key_name, or default if it does not exist."""
         return getattr(self, '%s__comment' % attribute_name, default)
 
+    def get_latest_observed(self):
+        """Returns the latest observed time of any of the Subject's attribute
+           values, found by scanning them all, or None if there is none."""
+        observed = [getattr(self, name) for name in self.dynamic_properties()
+                    if name.endswith('__observed')]
+        return max(filter(None, observed) or [None])
+
     def set_attribute(self, name, value, observed, author, author_nickname,
                       author_affiliation, comment):
         """Sets the value for the Attribute with the given key_name."""
+        if self.last_updated is None:
+            # The Subject predates last_updated, so catch up with the values
+            # set before it existed.
+            self.last_updated = self.get_latest_observed()
         setattr(self, '%s__' % name, value_or_none(value))
         setattr(self, '%s__observed' % name, value_or_none(observed))
+        if observed and not (self.last_updated and
+                             self.last_updated >= observed):
+            self.last_updated = observed
         setattr(self, '%s__author' % name, value_or_none(author))
         setattr(self, '%s__author_nickname' % name,
                 value_or_none(author_nickname))
@@ -209,6 +248,7 @@ class MinimalSubject(SubdomainMixin, db.Expando):
     necessary if we could select columns from the datastore."""
     type = db.StringProperty(required=True)  # key_name of a SubjectType,
                                              # without the subdomain prefix
+    last_updated = db.DateTimeProperty()  # copy of Subject.last_updated
     # More properties for the current values of ONLY the most critically
     # important attributes of Subject (named by Attribute's key_name).
     # An attribute named foo will be stored as 'foo__' to match Subject.
@@ -218,12 +258,21 @@ class MinimalSubject(SubdomainMixin, db.Expando):
     @staticmethod
     def create(subject):
         return MinimalSubject(
-            subject, key_name=subject.key().name(), type=subject.type)
+            subject, key_name=subject.key().name(), type=subject.type,
+            last_updated=subject.last_updated)
+
+    @staticmethod
+    def get_key(subdomain, subject_name):
+        """Gets the key of the MinimalSubject for the Subject with the given
+        subdomain and name."""
+        key_name = subdomain + ':' + subject_name
+        return db.Key.from_path(
+            'Subject', key_name, 'MinimalSubject', key_name)
 
     @staticmethod
     def get_by_subject(subject):
         """Gets the MinimalSubject entity for the given Subject."""
-        return MinimalSubject.all().ancestor(subject).get()
+        return db.get(MinimalSubject.get_key(subject.subdomain, subject.name))
 
     @staticmethod
     def get_stored_name(attribute_name):
@@ -244,15 +293,100 @@ class MinimalSubject(SubdomainMixin, db.Expando):
         setattr(self, '%s__' % name, value_or_none(value))
 
 
+class DataVersion(db.Model):
+    """A counter for the data in a subdomain, incremented whenever any Subject
+    in the subdomain is added, changed, or purged (see SubjectChange.record).
+    Top-level entity, has no parent.  Key name: subdomain name."""
+    version = db.IntegerProperty(default=0)
+
+    @staticmethod
+    def get_key(subdomain):
+        """Gets the key of the DataVersion for the given subdomain."""
+        return db.Key.from_path('DataVersion', subdomain)
+
+    @staticmethod
+    def get_version(subdomain):
+        """Gets the current data version for the given subdomain."""
+        data_version = DataVersion.get_by_key_name(subdomain)
+        return data_version and data_version.version or 0
+
+
+class SubjectChange(db.Model):
+    """A record of the most recent change to a Subject, so that clients can
+    fetch just the Subjects that changed since a given DataVersion.  Parent:
+    the subdomain's DataVersion, so that a change and the version it was
+    given are written in one transaction.  Key name: same as the Subject's
+    key name."""
+    subdomain = db.StringProperty(required=True)
+    subject_name = db.StringProperty(required=True)  # without the subdomain
+    version = db.IntegerProperty(required=True)  # DataVersion of the change
+    purged = db.BooleanProperty(default=False)  # True if Subject was purged
+
+    @staticmethod
+    def record(subdomain, subject_name, purged=False):
+        """Records a change to the given Subject under a new DataVersion,
+        and returns the new version.  Call this after the transaction that
+        modified the Subject has committed, or use queue_record inside it.
+        The DataVersion is incremented in the same transaction, so every
+        version a client has seen has its change in place, and versions are
+        given out in commit order."""
+        return SubjectChange.record_multi(subdomain, [subject_name], purged)
+
+    @staticmethod
+    def record_multi(subdomain, subject_names, purged=False):
+        """Records changes to all the given Subjects under one new
+        DataVersion, as record() does, and returns the new version."""
+        def work():
+            data_version = (DataVersion.get_by_key_name(subdomain) or
+                            DataVersion(key_name=subdomain))
+            data_version.version += 1
+            changes = [SubjectChange(
+                data_version, key_name=subdomain + ':' + subject_name,
+                subdomain=subdomain, subject_name=subject_name,
+                version=data_version.version, purged=purged)
+                for subject_name in subject_names]
+            db.put([data_version] + changes)
+            return data_version.version
+        return db.run_in_transaction(work)
+
+    @staticmethod
+    def queue_record(subdomain, subject_name, purged=False,
+                     transactional=True):
+        """Queues a task that records a change to the given Subject.  Call
+        this in the transaction that modifies the Subject, so that the task
+        is added if and only if the change commits; the task is retried
+        until the change is recorded."""
+        taskqueue.add(method='POST', url='/tasks/record_change', params={
+            'subdomain': subdomain,
+            'subject_name': subject_name,
+            'purged': purged and 'yes' or ''
+        }, transactional=transactional)
+
+    @staticmethod
+    def all_since(subdomain, version):
+        """Gets a query for all changes in the given subdomain that are newer
+        than the given DataVersion, oldest first.  This is an ancestor query,
+        so it sees every change recorded before it runs."""
+        return SubjectChange.all().ancestor(DataVersion.get_key(subdomain)
+            ).filter('version >', version).order('version')
+
+
 class UniqueId(db.Model):
-    """This entity is used just to generate unique numeric IDs."""
+    """This kind is used just to generate unique numeric IDs.  The IDs are
+    reserved in blocks with db.allocate_ids, so no entities are stored."""
+    next_id = None  # next ID to hand out from this process's block
+    last_id = None  # last ID in this process's block
+
     @staticmethod
     def create_id():
         """Gets a numeric ID that is guaranteed to be different from any ID
         previously returned by this static method."""
-        unique_id = UniqueId()
-        unique_id.put()
-        return unique_id.key().id()
+        if UniqueId.next_id is None or UniqueId.next_id > UniqueId.last_id:
+            UniqueId.next_id, UniqueId.last_id = db.allocate_ids(
+                db.Key.from_path('UniqueId', 1), UNIQUE_ID_BLOCK_SIZE)
+        id = UniqueId.next_id
+        UniqueId.next_id += 1
+        return id
 
 
 class SubjectType(SubdomainMixin, db.Model):
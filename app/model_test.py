@@ -0,0 +1,124 @@
+# Copyright 2010 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for model.py."""
+
+import datetime
+
+import model
+from medium_test_case import MediumTestCase
+from model import MinimalSubject, Subject, UniqueId
+
+class SubjectTest(MediumTestCase):
+    def test_last_updated(self):
+        """Confirms that set_attribute maintains last_updated."""
+        t1 = datetime.datetime(2010, 1, 1)
+        t2 = datetime.datetime(2010, 1, 2)
+        t3 = datetime.datetime(2010, 1, 3)
+        subject = Subject.create('haiti', 'hospital', 'example.org/1', None)
+        assert subject.last_updated is None
+        subject.set_attribute('title', 'foo', t2, None, None, None, None)
+        assert subject.last_updated == t2
+
+        # An older value doesn't move last_updated back.
+        subject.set_attribute('phone', '123', t1, None, None, None, None)
+        assert subject.last_updated == t2
+        subject.set_attribute('title', 'bar', t3, None, None, None, None)
+        assert subject.last_updated == t3
+
+        # A value with no observed time leaves last_updated alone.
+        subject.set_attribute('email', 'x@example.com', None,
+                              None, None, None, None)
+        assert subject.last_updated == t3
+
+    def test_last_updated_seeded(self):
+        """Confirms that set_attribute seeds a missing last_updated from the
+        observed times of the existing values."""
+        t1 = datetime.datetime(2010, 1, 1)
+        t2 = datetime.datetime(2010, 1, 2)
+        subject = Subject.create('haiti', 'hospital', 'example.org/1', None)
+        subject.set_attribute('title', 'foo', t2, None, None, None, None)
+        subject.last_updated = None  # as on a Subject stored before it existed
+        subject.put()
+
+        subject = Subject.get('haiti', 'example.org/1')
+        assert subject.get_latest_observed() == t2
+        subject.set_attribute('phone', '123', t1, None, None, None, None)
+        assert subject.last_updated == t2
+
+    def test_get_pairs(self):
+        """Confirms that get_pairs gets Subjects and their MinimalSubjects in
+        the order of the names, with None for missing entities."""
+        subject_1 = Subject.create('haiti', 'hospital', 'example.org/1', None)
+        subject_2 = Subject.create('haiti', 'hospital', 'example.org/2', None)
+        minimal_1 = MinimalSubject.create(subject_1)
+        subject_1.put()
+        subject_2.put()
+        minimal_1.put()
+
+        pairs = Subject.get_pairs(
+            'haiti', ['example.org/2', 'example.org/3', 'example.org/1'])
+        assert [(subject and subject.key(), minimal and minimal.key())
+                for subject, minimal in pairs] == [
+            (subject_2.key(), None), (None, None),
+            (subject_1.key(), minimal_1.key())]
+        assert Subject.get_pairs('haiti', []) == []
+        assert Subject.get_pairs('pakistan', ['example.org/1']) == [
+            (None, None)]
+
+
+class MinimalSubjectTest(MediumTestCase):
+    def test_get_key(self):
+        """Confirms that get_key gives the key of the MinimalSubject that
+        create() makes for a Subject."""
+        subject = Subject.create('haiti', 'hospital', 'example.org/1', None)
+        minimal_subject = MinimalSubject.create(subject)
+        key = MinimalSubject.get_key('haiti', 'example.org/1')
+        assert key == minimal_subject.key()
+        assert key.parent() == Subject.get_key('haiti', 'example.org/1')
+        assert key != MinimalSubject.get_key('pakistan', 'example.org/1')
+
+
+class UniqueIdTest(MediumTestCase):
+    def setUp(self):
+        MediumTestCase.setUp(self)
+        self.allocate_ids = model.db.allocate_ids
+        self.allocations = []
+        def allocate_ids(*args):
+            self.allocations.append(args)
+            return self.allocate_ids(*args)
+        model.db.allocate_ids = allocate_ids
+        self.block_size = model.UNIQUE_ID_BLOCK_SIZE
+        model.UNIQUE_ID_BLOCK_SIZE = 3
+        UniqueId.next_id = UniqueId.last_id = None
+
+    def tearDown(self):
+        model.db.allocate_ids = self.allocate_ids
+        model.UNIQUE_ID_BLOCK_SIZE = self.block_size
+        UniqueId.next_id = UniqueId.last_id = None
+
+    def test_create_id(self):
+        """Confirms that IDs are handed out from a block until it runs out,
+        and then from a new block."""
+        ids = [UniqueId.create_id() for i in range(3)]
+        assert ids == range(ids[0], ids[0] + 3)
+        assert len(self.allocations) == 1
+        assert self.allocations[0][1] == 3
+
+        # The fourth ID comes from a new block.
+        ids += [UniqueId.create_id() for i in range(4)]
+        assert len(self.allocations) == 3
+        assert len(set(ids)) == 7
+        assert ids[3] > ids[2]
+        assert ids[3:6] == range(ids[3], ids[3] + 3)
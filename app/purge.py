@@ -57,10 +57,11 @@ class Purge(utils.Handler):
             subject = model.Subject.get(subdomain, subject_name)
             if subject:
                 model.Subject.delete_complete(subject)
+                model.SubjectChange.queue_record(
+                    subdomain, subject_name, purged=True)
                 logging.info('admin.py: %s deleted subject with name %s' %
                              (self.account.email, subject_name))
-                cache.MINIMAL_SUBJECTS[subdomain].flush()
-                cache.JSON[subdomain].flush()
+            return subject
 
         if access.check_action_permitted(self.account, subdomain, 'purge'):
             full_name = '%s:%s' % (subdomain, subject_name)
@@ -85,7 +86,9 @@ class Purge(utils.Handler):
                 db.delete(subscriptions)
                 subscriptions = subscriptions_query.fetch(200)
 
-            db.run_in_transaction(work)
+            subject = db.run_in_transaction(work)
+            if subject:
+                cache.flush_subject(subdomain, subject_name)
 
 if __name__ == '__main__':
     utils.run([('/purge', Purge)], debug=True)
@@ -0,0 +1,35 @@
+# Copyright 2010 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Task handler that rebuilds a stale cache value in the background, queued
+by cache.queue_refresh.  The 'cache' parameter is the class name of the
+cache and 'key' is its subdomain or namespace."""
+
+import cache
+import rendering
+import utils
+
+class RefreshCache(utils.Handler):
+    def get(self):
+        class_name = self.request.get('cache')
+        key = self.request.get('key')
+        if class_name in ['JsonCache', 'ColumnarJsonCache']:
+            # The JSON is stored by rendering it.
+            columnar = class_name == 'ColumnarJsonCache'
+            rendering.write_json(key, columnar=columnar)
+        else:
+            cache.get_cache(class_name, key).refresh()
+
+if __name__ == '__main__':
+    utils.run([('/tasks/refresh_cache', RefreshCache)], debug=True)
@@ -13,14 +13,19 @@
 # limitations under the License.
 
 import cache
-import re
+import hashlib
 import sets
 import simplejson
 import sys
-from feedlib.geo import distance
+import time
 from model import Attribute, Subject, SubjectType, Message, MinimalSubject
+from model import DataVersion, SubjectChange
 from utils import Date, DateTime, HIDDEN_ATTRIBUTE_NAMES
-from utils import db, get_locale
+from utils import db, fetch_all
+
+# Number of subjects whose JSON is fetched from the cache and written out at
+# a time when streaming the data for a subdomain.
+FRAGMENT_BATCH_SIZE = 200
 
 def make_jobjects(entities, transformer, *args):
     """Run a sequence of entities through a transformer function that produces
@@ -51,8 +56,12 @@ def subject_type_transformer(index, subject_type, attribute_is):
                              if name not in HIDDEN_ATTRIBUTE_NAMES]}
 
 def minimal_subject_transformer(index, minimal_subject, attributes,
-                                subject_types, subject_type_is, center, radius):
-    """Construct the JSON object for a MinimalSubject."""
+                                subject_types, subject_type_is,
+                                distances=None):
+    """Construct the JSON object for a MinimalSubject.  If 'distances' is
+    given, it should be a dictionary of distances in metres keyed by subject
+    name, as computed in one batch by feedlib.geo.distances; subjects that are
+    not in it are omitted."""
     subdomain, type = minimal_subject.subdomain, minimal_subject.type
 
     # Gather all the attributes
@@ -70,21 +79,66 @@ def minimal_subject_transformer(index, minimal_subject, attributes,
         'type': subject_type_is[subdomain + ':' + type],
         'values': values,
     }
-    if (minimal_subject.has_value('location') and
-        minimal_subject.get_value('location')):
-        location = {
-            'lat': minimal_subject.get_value('location').lat,
-            'lon': minimal_subject.get_value('location').lon
-        }
-        if center:
-            subject_jobject['distance_meters'] = distance(location, center)
-
-    dist = subject_jobject.get('distance_meters')
-    if center and (dist is None or dist > radius > 0):
-        return None
+    if distances is not None:
+        if minimal_subject.name not in distances:
+            return None
+        subject_jobject['distance_meters'] = distances[minimal_subject.name]
 
     return subject_jobject
 
+def columnar_subjects_transformer(minimal_subjects, attributes,
+                                 subject_types, subject_type_is):
+    """Construct the JSON object for a list of MinimalSubjects in the columnar
+    format.  Instead of one object per subject with a value for every rendered
+    attribute, there is one column per attribute listing the indexes of the
+    subjects that have a value for it (counting from 1, as in make_jobjects)
+    and those values.  Values of 'choice' and 'multi' attributes are given as
+    indexes into the attribute's 'values', and values of 'geopt' attributes
+    as [lat, lon] in integer microdegrees relative to the previous value in
+    the column."""
+    minimal_attribute_names = {}
+    for name, subject_type in subject_types.items():
+        minimal_attribute_names[name] = sets.Set(
+            subject_type.minimal_attribute_names)
+
+    names = []
+    types = []
+    columns = [None]  # attributes are indexed starting from 1
+    for attribute in attributes:
+        columns.append({'subject_is': [], 'values': []})
+    for index, minimal_subject in enumerate(minimal_subjects):
+        subdomain, type = minimal_subject.subdomain, minimal_subject.type
+        names.append(minimal_subject.name)
+        types.append(subject_type_is[subdomain + ':' + type])
+        for a, attribute in enumerate(attributes):
+            name = attribute.key().name()
+            if name in minimal_attribute_names[type]:
+                value = minimal_subject.get_value(name)
+                if value is not None:
+                    columns[a + 1]['subject_is'].append(index + 1)
+                    columns[a + 1]['values'].append(value)
+
+    for attribute, column in zip(attributes, columns[1:]):
+        value_is = dict((value, i) for i, value in
+                        enumerate(attribute.values or []))
+        if attribute.type == 'choice':
+            column['values'] = [value_is.get(value, value)
+                                for value in column['values']]
+        elif attribute.type == 'multi':
+            column['values'] = [[value_is.get(value, value) for value in values]
+                                for values in column['values']]
+        elif attribute.type == 'geopt':
+            last_lat, last_lon = 0, 0
+            deltas = []
+            for location in column['values']:
+                lat = int(round(location.lat * 1000000))
+                lon = int(round(location.lon * 1000000))
+                deltas.append([lat - last_lat, lon - last_lon])
+                last_lat, last_lon = lat, lon
+            column['values'] = deltas
+
+    return {'names': names, 'types': types, 'columns': columns}
+
 def get_attributes_to_render(subject_types):
     """Returns the attributes of the given subject_types to be rendered.
     Enforces hiding of attributes in HIDDEN_ATTRIBUTE_NAMES."""
@@ -102,80 +156,274 @@ def json_encode(object):
         return {'lat': '%.6f' % object.lat, 'lon': '%.6f' % object.lon}
     raise TypeError(repr(object) + ' is not JSON serializable')
 
-def compress_json(json):
-    """Compresses json output by removing quotes from keys. This makes the
-       return value invalid json (all json keys must be double-quoted), but
-       the result is still valid javascript."""
-    return re.sub(r'"(\w+)":', r'\1:', json)
-
-def to_json(obj, indent=None):
-    """Invokes simplejson.dumps to serialize the given object."""
+def to_json(obj, indent=None, bare_keys=False):
+    """Invokes simplejson.dumps to serialize the given object.  If bare_keys
+       is true, keys are written without quotes where possible.  This makes
+       the return value invalid json (all json keys must be double-quoted),
+       but the result is still valid javascript and considerably smaller."""
     # set indent=2 to pretty-print; it blows up download size, so defaults off
-    return simplejson.dumps(obj, indent=indent, default=json_encode)
+    return simplejson.dumps(obj, indent=indent, default=json_encode,
+                            bare_keys=bare_keys)
 
-def to_minimal_subject_jobject(subdomain, minimal_subject):
-    """Converts the given MinimalSubject of Subject into an object that
-    can be passed to to_json()."""
+def get_layout(subdomain):
+    """Gets the attributes and subject types of the given subdomain, and their
+    JSON objects, in the order that indexes in subject JSON objects refer to.
+    Returns a tuple (attributes, subject_types, attribute_jobjects,
+    subject_type_jobjects, subject_type_is)."""
     subject_types = cache.SUBJECT_TYPES[subdomain]
+
+    # Get the subset of attributes to render.
     attributes = get_attributes_to_render(subject_types)
     attribute_jobjects, attribute_is = make_jobjects(
         attributes, attribute_transformer)
 
+    # Make JSON objects for the subject types.
     subject_type_jobjects, subject_type_is = make_jobjects(
         subject_types.values(), subject_type_transformer, attribute_is)
 
+    return (attributes, subject_types, attribute_jobjects,
+            subject_type_jobjects, subject_type_is)
+
+def get_layout_version(attribute_jobjects, subject_type_jobjects):
+    """Gets a short string that changes whenever the attribute or subject type
+    indexes used in subject JSON objects change."""
+    return hashlib.md5(to_json([attribute_jobjects, subject_type_jobjects])
+                       ).hexdigest()
+
+def join_json_object(items):
+    """Assembles a javascript object literal with bare keys from a list of
+    (key, json) pairs, where each key is an identifier and each json is an
+    already-encoded value."""
+    return '{%s}' % ', '.join(['%s: %s' % (key, json) for key, json in items])
+
+def to_minimal_subject_jobject(subdomain, minimal_subject):
+    """Converts the given MinimalSubject of Subject into an object that
+    can be passed to to_json()."""
+    attributes, subject_types, attribute_jobjects, subject_type_jobjects, \
+        subject_type_is = get_layout(subdomain)
+
     # Note index is irrelevant when transforming one object, so just pass -1
     return minimal_subject_transformer(-1, minimal_subject, attributes,
-                                       subject_types, subject_type_is,
-                                       center=None, radius=None)
+                                       subject_types, subject_type_is)
 
-def render_json(subdomain, center=None, radius=None):
-    """Dump the data for a subdomain as a JSON string."""
-    locale = get_locale()
-    json = cache.JSON[subdomain].get(locale)
-    if json and not center:
-        return json
+def render_json(subdomain, center=None, radius=None, columnar=False):
+    """Dump the data for a subdomain as a JSON string.  If 'columnar' is true,
+    the subjects are in the columnar format (see columnar_subjects_transformer)
+    and the payload has a 'format' of 'columnar'; this is not supported
+    together with a center."""
+    assert not (center and columnar)
+    if not center:
+        json_cache = (columnar and cache.COLUMNAR_JSON or cache.JSON)[subdomain]
+        return json_cache.get() or write_json(
+            subdomain, None, columnar)[1]
 
-    subject_types = cache.SUBJECT_TYPES[subdomain]
+    version = DataVersion.get_version(subdomain)
+    attributes, subject_types, attribute_jobjects, subject_type_jobjects, \
+        subject_type_is = get_layout(subdomain)
+    total_subject_count = len(cache.MINIMAL_SUBJECTS[subdomain])
+    return join_json_object([
+        ('version', to_json(version)),
+        ('total_subject_count', to_json(total_subject_count)),
+        ('attributes', to_json(attribute_jobjects, bare_keys=True)),
+        ('subject_types', to_json(subject_type_jobjects, bare_keys=True)),
+        ('subjects', to_json(get_nearby_subject_jobjects(
+            subdomain, center, radius, attributes, subject_types,
+            subject_type_is), bare_keys=True))])
 
-    # Get the subset of attributes to render.
-    attributes = get_attributes_to_render(subject_types)
-    attribute_jobjects, attribute_is = make_jobjects(
-        attributes, attribute_transformer)
+def write_json(subdomain, write=None, columnar=False):
+    """Renders the data for a subdomain as in render_json() with no center,
+    passing each chunk of JSON to the function 'write' (if given) as soon as
+    it is encoded, and then stores the JSON in the cache.  Returns the pair
+    (etag, json), as get_cached_json() does.
+    The subjects are encoded one batch at a time and written as they are
+    encoded, so the client gets the first bytes before the render finishes.
+    The chunks are kept to be stored, though: at the end this holds the
+    joined JSON, its pickled copy and the memcache shards cut from that,
+    about three times the size of the JSON."""
+    # Get the version before the data, so that a change that arrives while
+    # we render is sent again (rather than lost) to clients asking for deltas.
+    # Likewise get the cache generation before the data, so that if the cache
+    # is flushed while we render, the JSON is stored under the old generation
+    # and never served.
+    version = DataVersion.get_version(subdomain)
+    json_cache = (columnar and cache.COLUMNAR_JSON or cache.JSON)[subdomain]
+    generation = json_cache.get_generation()
+    start = time.time()
+    chunks = []
+    for chunk in iter_json(subdomain, columnar, version):
+        if write:
+            write(chunk)
+        chunks.append(chunk)
+    json = ''.join(chunks)
+    del chunks  # so the chunks aren't a fourth copy while the JSON is stored
+    json_cache.stats.record_load(time.time() - start)
+    etag = json_cache.set(json, version, generation)
+    return etag, json
 
-    # Make JSON objects for the subject types.
-    subject_type_jobjects, subject_type_is = make_jobjects(
-        subject_types.values(), subject_type_transformer, attribute_is)
+def iter_json(subdomain, columnar, version):
+    """Generates the chunks of JSON for all the data in a subdomain at the
+    given data version, as assembled by write_json()."""
+    attributes, subject_types, attribute_jobjects, subject_type_jobjects, \
+        subject_type_is = get_layout(subdomain)
+    layout = get_layout_version(attribute_jobjects, subject_type_jobjects)
 
-    # Make JSON objects for the subjects.
-    # Because storing the MinimalSubject entities into memcache is fairly
-    # slow (~3s for 1000 entities) and the JSON cache already provides almost
-    # all the benefit, we fetch the MinimalSubject entities directly from the
-    # datastore every time instead of letting the cache cache them.
-    minimal_subjects = \
-        cache.MINIMAL_SUBJECTS[subdomain].fetch_entities().values()
-    subject_jobjects, subject_is = make_jobjects(
-        sorted(minimal_subjects, key=lambda s: s.get_value('title')),
-        minimal_subject_transformer, attributes, subject_types,
-        subject_type_is, center, radius)
-    total_subject_count = len(minimal_subjects)
+    # Make JSON objects for the subjects.  MinimalSubjectCache keeps compact
+    # records rather than pickled entities, so reading it is cheap.
+    minimal_subjects = sorted(
+        cache.MINIMAL_SUBJECTS[subdomain].load().values(),
+        key=lambda s: s.get_value('title'))
 
-    # Sort by distance, if necessary.
-    if center:
-        subject_jobjects.sort(key=lambda s: s and s.get('distance_meters'))
+    # Leave the object open after 'subjects', which is written in chunks.
+    yield join_json_object((columnar and [('format', '"columnar"')] or []) + [
+        ('version', to_json(version)),
+        ('layout', to_json(layout)),
+        ('total_subject_count', to_json(len(minimal_subjects))),
+        ('attributes', to_json(attribute_jobjects, bare_keys=True)),
+        ('subject_types', to_json(subject_type_jobjects, bare_keys=True))]
+        )[:-1] + ', subjects: '
+    if columnar:
+        yield to_json(columnar_subjects_transformer(
+            minimal_subjects, attributes, subject_types, subject_type_is),
+            bare_keys=True)
+    else:
+        for chunk in iter_subjects_json(
+            subdomain, minimal_subjects, attributes, subject_types,
+            subject_type_is, layout):
+            yield chunk
+    yield '}'
 
-    # Get all the messages for the current language.
+def render_messages_json(locale):
+    """Dump all the messages for the given locale as a JSON object keyed by
+    namespace and then by name.  The messages are served apart from the data
+    (see messages.py), so edits to the data don't resend them."""
     message_jobjects = {}
     for message in cache.MESSAGES.values():
         namespace = message_jobjects.setdefault(message.ns, {})
         namespace[message.name] = getattr(message, locale)
+    return to_json(message_jobjects, bare_keys=True)
 
-    json = compress_json(to_json({
-        'total_subject_count': total_subject_count,
-        'attributes': attribute_jobjects,
-        'subject_types': subject_type_jobjects,
-        'subjects': subject_jobjects,
-        'messages': message_jobjects}))
-    if not center:
-        cache.JSON[subdomain].set(locale, json)
+def get_cached_json(subdomain, columnar=False, stale=False):
+    """Gets the data for a subdomain as stored by write_json() along with its
+    ETag.  Returns a pair (etag, json), which is (None, None) if the data is
+    not in the cache.  If 'stale' is true, the data from before the last
+    change may be returned while it is rebuilt in the background (see
+    JsonCache.lookup)."""
+    json_cache = (columnar and cache.COLUMNAR_JSON or cache.JSON)[subdomain]
+    return json_cache.get_with_etag(stale)
+
+def get_nearby_subject_jobjects(subdomain, center, radius, attributes,
+                                subject_types, subject_type_is):
+    """Makes the list of JSON objects for the located subjects in a subdomain
+    that are within the given radius of the center, nearest first.  If the
+    radius is not positive, includes all located subjects."""
+    minimal_subjects = cache.MINIMAL_SUBJECTS[subdomain]
+    # The spatial index looks only at the cells near the center and measures
+    # the distances to all the candidates in one batch.
+    nearby = minimal_subjects.get_spatial_index().nearest(
+        center, radius > 0 and radius or None)
+    subject_jobjects, subject_is = make_jobjects(
+        [minimal_subjects[name] for distance, name in nearby],
+        minimal_subject_transformer, attributes, subject_types,
+        subject_type_is, dict((name, distance) for distance, name in nearby))
+    return subject_jobjects
+
+def render_subjects_json(subdomain, minimal_subjects, attributes,
+                         subject_types, subject_type_is, layout):
+    """Dump the given MinimalSubjects as a JSON array, preceded by a null
+    as in make_jobjects()."""
+    return ''.join(iter_subjects_json(
+        subdomain, minimal_subjects, attributes, subject_types,
+        subject_type_is, layout))
+
+def iter_subjects_json(subdomain, minimal_subjects, attributes,
+                       subject_types, subject_type_is, layout):
+    """Generates the chunks of the JSON array for render_subjects_json(),
+    one for each batch of FRAGMENT_BATCH_SIZE subjects.  The JSON for each
+    subject is taken from the JSON_FRAGMENTS cache if present and encoded
+    from the same values (see cache.MinimalSubjectRecord.get_stamp), so only
+    changed subjects get encoded."""
+    fragment_cache = cache.JSON_FRAGMENTS[subdomain]
+    generation = fragment_cache.get_generation()  # as in write_json()
+    yield '[null'
+    for start in range(0, len(minimal_subjects), FRAGMENT_BATCH_SIZE):
+        batch = minimal_subjects[start:start + FRAGMENT_BATCH_SIZE]
+        stamps = dict((minimal_subject.name, minimal_subject.get_stamp())
+                      for minimal_subject in batch)
+        fragments = fragment_cache.get_multi(layout, stamps)
+        new_fragments = {}
+        for minimal_subject in batch:
+            name = minimal_subject.name
+            if name not in fragments:
+                fragments[name] = to_json(
+                    minimal_subject_transformer(
+                        -1, minimal_subject, attributes, subject_types,
+                        subject_type_is), bare_keys=True)
+                new_fragments[name] = (stamps[name], fragments[name])
+        if new_fragments:
+            fragment_cache.set_multi(layout, new_fragments, generation)
+        yield ''.join([', ' + fragments[minimal_subject.name]
+                       for minimal_subject in batch])
+    yield ']'
+
+def render_tile_json(subdomain, zoom, x, y):
+    """Dump the located subjects in the given map tile (see
+    feedlib.geo.get_tile) as a JSON string.  Subjects are rendered with the
+    same attribute and subject type indexes as in render_json(), and the
+    payload includes the layout version of those indexes, so that clients
+    can tell when to reload the attributes and subject types."""
+    attributes, subject_types, attribute_jobjects, subject_type_jobjects, \
+        subject_type_is = get_layout(subdomain)
+    layout = get_layout_version(attribute_jobjects, subject_type_jobjects)
+    tile_cache = cache.TILES[subdomain]
+    minimal_subjects = cache.MINIMAL_SUBJECTS[subdomain]
+    stamp = minimal_subjects.get_tile_stamp(zoom, x, y)
+    json = tile_cache.get(layout, stamp, zoom, x, y)
+    if json is None:
+        # As in write_json(), get the version and generation before the data.
+        version = DataVersion.get_version(subdomain)
+        generation = tile_cache.get_generation()
+        subjects_json = render_subjects_json(
+            subdomain, [minimal_subjects[name] for name in
+                        minimal_subjects.get_tile_names(zoom, x, y)],
+            attributes, subject_types, subject_type_is, layout)
+        json = join_json_object([
+            ('version', to_json(version)),
+            ('layout', to_json(layout)),
+            ('subjects', subjects_json)])
+        tile_cache.set(layout, stamp, zoom, x, y, json, generation)
     return json
+
+def render_delta_json(subdomain, since):
+    """Dump the subjects that were added, changed, or purged in a subdomain
+    after the data version 'since' as a JSON string.  Subjects are rendered
+    with the same attribute and subject type indexes as in render_json(), and
+    the payload includes the layout version of those indexes, as in
+    render_tile_json(), so that clients can tell when to reload the full
+    data instead."""
+    # Any change up to this version is sure to be found by the query below,
+    # which may also find newer ones.
+    version = DataVersion.get_version(subdomain)
+    attributes, subject_types, attribute_jobjects, subject_type_jobjects, \
+        subject_type_is = get_layout(subdomain)
+
+    purged_names = []
+    changed_keys = []
+    for change in fetch_all(SubjectChange.all_since(subdomain, since)):
+        version = max(version, change.version)
+        if change.purged:
+            purged_names.append(change.subject_name)
+        else:
+            changed_keys.append(
+                MinimalSubject.get_key(subdomain, change.subject_name))
+
+    minimal_subjects = filter(None, db.get(changed_keys))
+    subject_jobjects = [
+        minimal_subject_transformer(-1, minimal_subject, attributes,
+                                    subject_types, subject_type_is)
+        for minimal_subject in minimal_subjects]
+
+    return to_json({
+        'version': version,
+        'layout': get_layout_version(attribute_jobjects, subject_type_jobjects),
+        'subjects': subject_jobjects,
+        'purged': purged_names}, bare_keys=True)
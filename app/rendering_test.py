@@ -0,0 +1,230 @@
+# Copyright 2010 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for rendering.py."""
+
+import unittest
+
+from google.appengine.ext import db
+
+import cache
+import rendering
+import simplejson
+from medium_test_case import MediumTestCase
+from model import Attribute, MinimalSubject, Subject, SubjectType
+
+def decode_choice(choices, value):
+    """Decodes a choice value as decode_choice in static/map.js does."""
+    if isinstance(value, int):
+        return choices[value]
+    return value
+
+def decode_columnar_subjects(columnar, attribute_jobjects):
+    """Decodes subjects in the columnar format into the usual subject JSON
+    objects, as decode_columnar_subjects in static/map.js does."""
+    decoded = [None]
+    for name, type in zip(columnar['names'], columnar['types']):
+        decoded.append({'name': name, 'type': type,
+                        'values': [None]*len(attribute_jobjects)})
+    for a in range(1, len(columnar['columns'])):
+        column = columnar['columns'][a]
+        attribute = attribute_jobjects[a]
+        lat, lon = 0, 0
+        for subject_i, value in zip(column['subject_is'], column['values']):
+            if attribute['type'] == 'choice':
+                value = decode_choice(attribute['values'], value)
+            elif attribute['type'] == 'multi':
+                value = [decode_choice(attribute['values'], v) for v in value]
+            elif attribute['type'] == 'geopt':
+                lat += value[0]
+                lon += value[1]
+                value = {'lat': '%.6f' % (lat/1e6), 'lon': '%.6f' % (lon/1e6)}
+            decoded[subject_i]['values'][a] = value
+    return decoded
+
+class RenderingTest(unittest.TestCase):
+    def test_to_json(self):
+        assert rendering.to_json({'a': 1}) == '{"a": 1}'
+        assert rendering.to_json([1, 'b', None]) == '[1, "b", null]'
+
+    def test_to_json_bare_keys(self):
+        """Confirms that keys that are identifiers are written without
+        quotes, at any depth, and that all other keys stay quoted."""
+        to_json = lambda obj: rendering.to_json(obj, bare_keys=True)
+        assert to_json({'a': 1}) == '{a: 1}'
+        assert to_json({'a_1': {'b': [{'_c': 'd'}]}}) == \
+            '{a_1: {b: [{_c: "d"}]}}'
+
+        # Only keys are affected, not values that look like keys.
+        assert to_json({'a': 'b: c'}) == '{a: "b: c"}'
+        assert to_json(['a', {'b': 'c'}]) == '["a", {b: "c"}]'
+
+        # Keys that are not JavaScript identifiers stay quoted.
+        assert to_json({'9z': 1}) == '{"9z": 1}'
+        assert to_json({'a-b': 1}) == '{"a-b": 1}'
+        assert to_json({'a\n': 1}) == '{"a\\n": 1}'
+        assert to_json({'': 1}) == '{"": 1}'
+        assert to_json({u'\xe9': 1}) == '{"\\u00e9": 1}'
+        assert to_json({1: 2}) == '{"1": 2}'
+
+
+class ColumnarTest(MediumTestCase):
+    def setUp(self):
+        MediumTestCase.setUp(self)
+        self.attributes = [
+            Attribute(key_name='title', type='str'),
+            Attribute(key_name='status', type='choice',
+                      values=['open', 'closed']),
+            Attribute(key_name='services', type='multi',
+                      values=['a', 'b', 'c']),
+            Attribute(key_name='location', type='geopt')]
+        hospital = SubjectType.create('haiti', 'hospital')
+        hospital.minimal_attribute_names = [
+            'title', 'status', 'services', 'location']
+        clinic = SubjectType.create('haiti', 'clinic')
+        clinic.minimal_attribute_names = ['title']
+        self.subject_types = {'hospital': hospital, 'clinic': clinic}
+        self.subject_type_jobjects, self.subject_type_is = \
+            rendering.make_jobjects([hospital, clinic], lambda i, st: st.name)
+
+        self.minimal_subjects = []
+        for name, type, values in [
+            ('example.org/1', 'hospital', {
+                'title': 'A', 'status': 'closed', 'services': ['b', 'x'],
+                'location': db.GeoPt(18.5, -72.3)}),
+            ('example.org/2', 'clinic', {'title': 'B', 'status': 'open'}),
+            ('example.org/3', 'hospital', {
+                'title': 'C', 'status': 'other',
+                'location': db.GeoPt(18.25, -72.125)})]:
+            minimal_subject = MinimalSubject.create(
+                Subject.create('haiti', type, name, None))
+            for key, value in values.items():
+                minimal_subject.set_attribute(key, value)
+            self.minimal_subjects.append(minimal_subject)
+
+    def get_columnar(self):
+        return rendering.columnar_subjects_transformer(
+            self.minimal_subjects, self.attributes, self.subject_types,
+            self.subject_type_is)
+
+    def test_columnar_subjects_transformer(self):
+        columnar = self.get_columnar()
+        assert columnar['names'] == [
+            'example.org/1', 'example.org/2', 'example.org/3']
+        assert columnar['types'] == [1, 2, 1]
+        title, status, services, location = columnar['columns'][1:]
+        assert title == {'subject_is': [1, 2, 3], 'values': ['A', 'B', 'C']}
+
+        # Choices are given as indexes; other values are left as they are.
+        # Attributes that a subject type doesn't show are left out.
+        assert status == {'subject_is': [1, 3], 'values': [1, 'other']}
+        assert services == {'subject_is': [1], 'values': [[1, 'x']]}
+
+        # Locations are in microdegrees, relative to the previous location.
+        assert location == {'subject_is': [1, 3], 'values': [
+            [18500000, -72300000], [-250000, 175000]]}
+
+    def test_decode_columnar_subjects(self):
+        """Confirms that decoding the columnar format (as the map does)
+        gives the same subject objects as the default format."""
+        attribute_jobjects, attribute_is = rendering.make_jobjects(
+            self.attributes, rendering.attribute_transformer)
+        columnar = simplejson.loads(rendering.to_json(self.get_columnar()))
+        decoded = decode_columnar_subjects(
+            columnar, simplejson.loads(rendering.to_json(attribute_jobjects)))
+        expected = simplejson.loads(rendering.to_json([
+            rendering.minimal_subject_transformer(
+                -1, minimal_subject, self.attributes, self.subject_types,
+                self.subject_type_is)
+            for minimal_subject in self.minimal_subjects]))
+        assert decoded[1:] == expected
+        assert decoded[3]['values'][4] == {'lat': '18.250000',
+                                           'lon': '-72.125000'}
+
+
+class RenderRaceTest(MediumTestCase):
+    """Tests of renders that overlap with an edit."""
+    def setUp(self):
+        MediumTestCase.setUp(self)
+        subject_type = SubjectType.create('haiti', 'hospital')
+        subject_type.attribute_names = ['title', 'location']
+        subject_type.minimal_attribute_names = ['title', 'location']
+        self.subject = Subject.create(
+            'haiti', 'hospital', 'example.org/1', None)
+        self.minimal_subject = MinimalSubject.create(self.subject)
+        for name, value in [('title', 'foo'),
+                            ('location', db.GeoPt(18.5, -72.3))]:
+            self.subject.set_attribute(
+                name, value, None, None, None, None, None)
+            self.minimal_subject.set_attribute(name, value)
+        self.entities = [
+            Attribute(key_name='title', type='str'),
+            Attribute(key_name='location', type='geopt'),
+            subject_type, self.subject, self.minimal_subject]
+        db.put(self.entities)
+        cache.flush_all()
+
+    def tearDown(self):
+        db.delete(self.entities)
+        cache.flush_all()
+
+    def edit(self, title):
+        """Changes the title of the subject as an edit would."""
+        self.subject.set_attribute('title', title, None, None, None, None,
+                                   None)
+        self.minimal_subject.set_attribute('title', title)
+        db.put([self.subject, self.minimal_subject])
+        cache.flush_subject('haiti', 'example.org/1', self.subject)
+
+    def get_layout(self):
+        attributes, subject_types, attribute_jobjects, subject_type_jobjects, \
+            subject_type_is = rendering.get_layout('haiti')
+        return (attributes, subject_types, subject_type_is,
+                rendering.get_layout_version(
+                    attribute_jobjects, subject_type_jobjects))
+
+    def test_fragment_race(self):
+        """Confirms that a subject's fragment from a render that read the
+        subject before an edit, but stored the fragment after the edit was
+        flushed, is not served."""
+        attributes, subject_types, subject_type_is, layout = self.get_layout()
+        chunks = rendering.iter_subjects_json(
+            'haiti', cache.MINIMAL_SUBJECTS['haiti'].load().values(),
+            attributes, subject_types, subject_type_is, layout)
+        assert chunks.next() == '[null'
+
+        self.edit('bar')
+        assert '"foo"' in ''.join(chunks)
+
+        json = rendering.write_json('haiti')[1]
+        assert '"bar"' in json
+        assert '"foo"' not in json
+
+    def test_tile_race(self):
+        """Confirms that a tile from a render that read the subjects before
+        an edit, but stored the tile after the edit was flushed, is not
+        served."""
+        layout = self.get_layout()[3]
+        tiles = cache.TILES['haiti']
+        x, y = cache.get_tile({'lat': 18.5, 'lon': -72.3}, 5)
+        generation = tiles.get_generation()
+        stamp = cache.MINIMAL_SUBJECTS['haiti'].get_tile_stamp(5, x, y)
+        json = rendering.render_tile_json('haiti', 5, x, y)
+        assert '"foo"' in json
+
+        self.edit('bar')
+        tiles.set(layout, stamp, 5, x, y, json, generation)
+        json = rendering.render_tile_json('haiti', 5, x, y)
+        assert '"bar"' in json
+        assert '"foo"' not in json
@@ -26,6 +26,7 @@ Requests can be handled by accounts with 'grant' action permission
 in grant_access.py
 """
 
+import cache
 import model
 import utils
 from utils import DateTime, ErrorMessage, Redirect
@@ -61,6 +62,7 @@ class RequestAccess(utils.Handler):
                 'Your request for "%(action)s" permission is now pending' %
                 {'action': action})
             self.account.put()
+            cache.ACCOUNTS.invalidate(self.account)
 
         if self.params.embed:
             self.write(message)
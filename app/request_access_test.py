@@ -0,0 +1,61 @@
+# Copyright 2010 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests for request_access.py."""
+
+import webob
+
+from google.appengine.ext import db, webapp
+
+import cache
+import request_access
+from medium_test_case import MediumTestCase
+from model import Account
+from utils import users
+
+class RequestAccessTest(MediumTestCase):
+    def setUp(self):
+        MediumTestCase.setUp(self)
+        self.user = users.User('test@example.com')
+        self.account = Account(email='test@example.com', actions=['*:view'])
+        self.account.put()
+        cache.ACCOUNTS.flush()
+
+    def tearDown(self):
+        db.delete(self.account)
+        cache.ACCOUNTS.flush()
+
+    def simulate_request(self, path):
+        request = webapp.Request(webob.Request.blank(path).environ)
+        response = webapp.Response()
+        handler = request_access.RequestAccess()
+        handler.initialize(request, response, self.user)
+        return handler
+
+    def test_request_invalidates_account(self):
+        """Confirms that a request for access invalidates the cached Account
+        of the user who made it."""
+        handler = self.simulate_request(
+            '/request_access?subdomain=haiti&action=edit&embed=yes')
+        assert handler.account.requested_actions == []
+        handler.post()
+        assert 'pending' in handler.response.out.getvalue()
+        assert cache.ACCOUNTS.get(
+            'email', 'test@example.com').requested_actions == ['edit']
+
+        # The next request sees the pending request.
+        handler = self.simulate_request(
+            '/request_access?subdomain=haiti&action=edit&embed=yes')
+        assert handler.account.requested_actions == ['edit']
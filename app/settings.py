@@ -19,8 +19,9 @@ from operator import itemgetter
 
 from google.appengine.api import users
 
+import cache
 import config
-from model import Subject, Subscription
+from model import Subscription
 from utils import _, Handler, run
 
 SETTINGS_PATH = 'templates/settings.html'
@@ -37,11 +38,13 @@ class Settings(Handler):
     def get(self):
         self.init()
 
-        subscriptions = Subscription.all().filter('user_email =',
-                                                  self.account.email)
+        subscriptions = list(Subscription.all().filter('user_email =',
+                                                       self.account.email))
+        subjects_by_key_name = cache.SUBJECTS.get_multi_by_key_name(
+            [subscription.subject_name for subscription in subscriptions])
         subjects = []
         for subscription in subscriptions:
-            subject = Subject.get_by_key_name(subscription.subject_name)
+            subject = subjects_by_key_name[subscription.subject_name]
             subjects.append({
                 'name': subscription.subject_name,
                 'title': subject.get_value('title'),
@@ -14,6 +14,7 @@ except ImportError:
 ESCAPE = re.compile(r'[\x00-\x1f\\"\b\f\n\r\t]')
 ESCAPE_ASCII = re.compile(r'([\\"]|[^\ -~])')
 HAS_UTF8 = re.compile(r'[\x80-\xff]')
+BARE_KEY = re.compile(r'[A-Za-z_]\w*\Z')
 ESCAPE_DCT = {
     '\\': '\\\\',
     '"': '\\"',
@@ -100,7 +101,8 @@ class JSONEncoder(object):
     key_separator = ': '
     def __init__(self, skipkeys=False, ensure_ascii=True,
             check_circular=True, allow_nan=True, sort_keys=False,
-            indent=None, separators=None, encoding='utf-8', default=None):
+            indent=None, separators=None, encoding='utf-8', default=None,
+            bare_keys=False):
         """Constructor for JSONEncoder, with sensible defaults.
 
         If skipkeys is false, then it is a TypeError to attempt
@@ -142,6 +144,10 @@ class JSONEncoder(object):
         transformed into unicode using that encoding prior to JSON-encoding.
         The default is UTF-8.
 
+        If bare_keys is true, then object keys that are ASCII identifiers
+        are emitted without quotes.  The output is then not valid JSON, but
+        it is still a valid JavaScript literal.
+
         """
 
         self.skipkeys = skipkeys
@@ -155,6 +161,7 @@ class JSONEncoder(object):
         if default is not None:
             self.default = default
         self.encoding = encoding
+        self.bare_keys = bare_keys
 
     def default(self, o):
         """Implement this method in a subclass such that it returns
@@ -226,6 +233,14 @@ class JSONEncoder(object):
                     o = o.decode(_encoding)
                 return _orig_encoder(o)
 
+        if self.bare_keys:
+            def _key_encoder(key, _encoder=_encoder, _match=BARE_KEY.match):
+                if _match(key):
+                    return str(key)
+                return _encoder(key)
+        else:
+            _key_encoder = _encoder
+
         def floatstr(o, allow_nan=self.allow_nan, _repr=FLOAT_REPR, _inf=INFINITY, _neginf=-INFINITY):
             # Check for specials.  Note that this type of test is processor- and/or
             # platform-specific, so do tests which don't depend on the internals.
@@ -247,7 +262,8 @@ class JSONEncoder(object):
             return text
 
 
-        if _one_shot and c_make_encoder is not None and not self.indent and not self.sort_keys:
+        if (_one_shot and c_make_encoder is not None and not self.indent and
+                not self.sort_keys and not self.bare_keys):
             _iterencode = c_make_encoder(
                 markers, self.default, _encoder, self.indent,
                 self.key_separator, self.item_separator, self.sort_keys,
@@ -256,10 +272,10 @@ class JSONEncoder(object):
             _iterencode = _make_iterencode(
                 markers, self.default, _encoder, self.indent, floatstr,
                 self.key_separator, self.item_separator, self.sort_keys,
-                self.skipkeys, _one_shot)
+                self.skipkeys, _one_shot, _key_encoder)
         return _iterencode(o, 0)
 
-def _make_iterencode(markers, _default, _encoder, _indent, _floatstr, _key_separator, _item_separator, _sort_keys, _skipkeys, _one_shot,
+def _make_iterencode(markers, _default, _encoder, _indent, _floatstr, _key_separator, _item_separator, _sort_keys, _skipkeys, _one_shot, _key_encoder,
         ## HACK: hand-optimized bytecode; turn globals into locals
         False=False,
         True=True,
@@ -376,7 +392,7 @@ def _make_iterencode(markers, _default, _encoder, _indent, _floatstr, _key_separ
                 first = False
             else:
                 yield item_separator
-            yield _encoder(key)
+            yield _key_encoder(key)
             yield _key_separator
             if isinstance(value, basestring):
                 yield _encoder(value)
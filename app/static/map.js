@@ -70,6 +70,11 @@ var subjects = [null];
 var subject_is = [];
 var messages = {};  // {namespace: {name: message}
 var total_subject_count = 0;
+var data_version = 0;  // version of the data, for fetching changes
+var data_layout = null;  // version of the attribute and subject type indexes
+
+// Interval at which to poll data_url for changed subjects
+var DATA_POLL_INTERVAL_MS = 60000;
 
 // Timer for temporary status messages
 var status_timer;
@@ -1317,9 +1322,13 @@ function get_browser_width() {
 function load_data(data, selected_subject_name) {
   attributes = data.attributes;
   subject_types = data.subject_types;
-  subjects = data.subjects;
-  messages = data.messages;
+  subjects = data.format == 'columnar' ?
+      decode_columnar_subjects(data.subjects) : data.subjects;
+  // The messages are normally loaded separately from messages_url.
+  messages = data.messages || messages;
   total_subject_count = data.total_subject_count;
+  data_version = data.version || 0;
+  data_layout = data.layout || null;
 
   attributes_by_name = {};
   for (var a = 1; a < attributes.length; a++) {
@@ -1379,12 +1388,151 @@ function load_data(data, selected_subject_name) {
   show_loading(false);
   log('Data loaded.');
 
+  if (data_url) {
+    setTimeout(poll_data, DATA_POLL_INTERVAL_MS);
+  }
+
   // TODO: Test further and re-enable
   //start_monitoring();
 }
 
 // ==== In-place update
 
+/**
+ * Rebuilds the list of subjects, as given in the default data format, from
+ * the subjects in the columnar format (see columnar_subjects_transformer in
+ * rendering.py).  Must be called after attributes is set.
+ * @param {Object} columnar object with 'names', 'types', and 'columns'
+ * @return {Array} subjects, with item 0 null
+ */
+function decode_columnar_subjects(columnar) {
+  var decoded = [null];
+  for (var i = 0; i < columnar.names.length; i++) {
+    var values = [null];
+    for (var a = 1; a < attributes.length; a++) {
+      values.push(null);
+    }
+    decoded.push(
+        {name: columnar.names[i], type: columnar.types[i], values: values});
+  }
+  for (var a = 1; a < columnar.columns.length; a++) {
+    var column = columnar.columns[a];
+    var choices = attributes[a].values;
+    var lat = 0, lon = 0;
+    for (var j = 0; j < column.subject_is.length; j++) {
+      var value = column.values[j];
+      switch (attributes[a].type) {
+        case 'choice':
+          value = decode_choice(choices, value);
+          break;
+        case 'multi':
+          for (var k = 0; k < value.length; k++) {
+            value[k] = decode_choice(choices, value[k]);
+          }
+          break;
+        case 'geopt':
+          lat += value[0];
+          lon += value[1];
+          value = {lat: (lat / 1e6).toFixed(6), lon: (lon / 1e6).toFixed(6)};
+          break;
+      }
+      decoded[column.subject_is[j]].values[a] = value;
+    }
+  }
+  return decoded;
+}
+
+/**
+ * Decodes a choice value given in the columnar data format.
+ * @param {Array} choices the 'values' of the attribute
+ * @param {number|string} value an index into choices, or a value that is
+ *     not one of the choices
+ * @return {string} the choice value
+ */
+function decode_choice(choices, value) {
+  return typeof value == 'number' ? choices[value] : value;
+}
+
+/**
+ * Fetches the subjects that changed since data_version from data_url,
+ * applies them, and schedules the next poll.
+ */
+function poll_data() {
+  var url = data_url + (data_url.indexOf('?') >= 0 ? '&' : '?') +
+      'since=' + data_version;
+  $j.ajax({
+    url: url,
+    type: 'GET',
+    dataType: 'text',
+    timeout: 30000,
+    error: function(request, text_status, error_thrown) {
+      log('poll_data: ' + text_status + ', ' + error_thrown);
+      setTimeout(poll_data, DATA_POLL_INTERVAL_MS);
+    },
+    success: function(text) {
+      // The payload has unquoted keys, so it has to be evaluated.
+      apply_delta(eval('(' + text + ')'));
+      setTimeout(poll_data, DATA_POLL_INTERVAL_MS);
+    }
+  });
+}
+
+/**
+ * Applies a delta returned by data_url: adds or replaces the changed
+ * subjects and removes the purged ones.
+ * @param {Object} delta object with 'version', 'layout', 'subjects', and
+ *     'purged'
+ */
+function apply_delta(delta) {
+  if (data_layout && delta.layout != data_layout) {
+    // The attributes or subject types have changed, so the indexes in the
+    // changed subjects don't match the loaded ones; start over.
+    window.location.reload();
+    return;
+  }
+  if (!delta.subjects.length && !delta.purged.length) {
+    data_version = delta.version;
+    return;
+  }
+  var subject_is_by_name = {};
+  for (var su = 1; su < subjects.length; su++) {
+    if (subjects[su]) {
+      subject_is_by_name[subjects[su].name] = su;
+    }
+  }
+  for (var i = 0; i < delta.subjects.length; i++) {
+    var subject = delta.subjects[i];
+    var subject_i = subject_is_by_name[subject.name];
+    if (subject_i) {
+      remove_marker(subject_i);
+      subjects[subject_i] = subject;
+    } else {
+      subject_i = subjects.length;
+      subjects.push(subject);
+      subject_is.push(subject_i);
+      total_subject_count++;
+    }
+    add_marker(subject_i);
+  }
+  for (var i = 0; i < delta.purged.length; i++) {
+    var subject_i = subject_is_by_name[delta.purged[i]];
+    if (subject_i) {
+      remove_marker(subject_i);
+      subject_is = filter(subject_is, function(su) {
+        return su != subject_i;
+      });
+      total_subject_count--;
+    }
+  }
+  data_version = delta.version;
+
+  update_subject_status_is();
+  update_subject_icons();
+  populate_subject_list();
+  log('Applied ' + delta.subjects.length + ' changed and ' +
+      delta.purged.length + ' purged subjects.');
+}
+
 function start_monitoring() {
   // TODO: fix for IE
   var xhr = new XMLHttpRequest();
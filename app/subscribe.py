@@ -27,6 +27,7 @@ import simplejson
 
 from django.conf import settings
 
+import cache
 import config
 import model
 import utils
@@ -34,7 +35,7 @@ from bubble import format
 from feedlib.xml_utils import Struct
 from mail_alerts import EMAIL_FORMATTERS, fetch_updates, format_email_subject
 from mail_alerts import send_email, update_account_alert_time
-from model import PendingAlert, Subject, Subscription
+from model import PendingAlert, Subscription
 from utils import _, db, Handler, run
 
 class Subscribe(Handler):
@@ -101,6 +102,7 @@ class Subscribe(Handler):
         if frequency != 'instant':
             update_account_alert_time(self.account, frequency, initial=True)
         db.put(self.account)
+        cache.ACCOUNTS.invalidate(self.account)
  
     def unsubscribe(self):
         """Unsubscribes the current user from a particular subject."""
@@ -133,6 +135,7 @@ class Subscribe(Handler):
             locale = config.LANG_FALLBACKS.get(lang, settings.LANGUAGE_code)
         self.account.locale = locale
         db.put(self.account)
+        cache.ACCOUNTS.invalidate(self.account)
 
     def change_email_format(self):
         """Changes the current user's preferred e-mail format."""
@@ -141,6 +144,7 @@ class Subscribe(Handler):
             self.error(400) # bad request
         self.account.email_format = format
         db.put(self.account)
+        cache.ACCOUNTS.invalidate(self.account)
 
     def change_subscription(self, subject_name, old_frequency, new_frequency):
         """Change's the current user's subscription to a subject."""
@@ -154,7 +158,8 @@ class Subscribe(Handler):
                                      subject_name)
         if old_alert:
             if new_frequency == 'instant':
-                subject = Subject.get_by_key_name(old_alert.subject_name)
+                subject = cache.SUBJECTS.get_by_key_name(
+                    old_alert.subject_name)
                 values = fetch_updates(old_alert, subject)
                 email_data = Struct(
                     nickname=self.account.nickname or self.account.email,
@@ -208,6 +213,7 @@ class Subscribe(Handler):
             self.error(400) # bad request
         self.account.default_frequency = frequency
         db.put(self.account)
+        cache.ACCOUNTS.invalidate(self.account)
 
     def check_and_update_next_alert_times(self, frequency):
         """If a user is no longer subscribed to %frequency% digest updates, sets
@@ -220,9 +226,11 @@ class Subscribe(Handler):
             'frequency =', frequency).count():
             setattr(self.account, 'next_%s_alert' % frequency, model.MAX_DATE)
             db.put(self.account)
+            cache.ACCOUNTS.invalidate(self.account)
         else:
             update_account_alert_time(self.account, frequency, initial=True)
             db.put(self.account)
+            cache.ACCOUNTS.invalidate(self.account)
 
 
 if __name__ == '__main__':
@@ -23,6 +23,7 @@ from google.appengine.api import mail
 from google.appengine.ext import db, webapp
 from google.appengine.ext.db import BadValueError
 
+import cache
 import model
 import simplejson
 import subscribe
@@ -372,6 +373,32 @@ class MailUpdateSystemTest(MediumTestCase):
         subscribe_.check_and_update_next_alert_times('monthly')
         assert Account.all().get().next_weekly_alert == model.MAX_DATE
 
+    def test_account_cache(self):
+        """Confirms that changes to the account invalidate the cached copy
+        used to identify the user."""
+        self.account.next_daily_alert = model.MAX_DATE
+        db.put(self.account)
+        handler = self.simulate_request('/subscribe?action=subscribe&' +
+                                        'subject_name=haiti:example.org/123&' +
+                                        'frequency=daily')
+        assert handler.account.next_daily_alert == model.MAX_DATE
+        handler.post()
+        account = cache.ACCOUNTS.get('email', self.email)
+        assert account.next_daily_alert < model.MAX_DATE
+
+        handler = self.simulate_request('/subscribe?subdomain=haiti&' +
+                                        'action=change_default_frequency&' +
+                                        'frequency=monthly')
+        handler.post()
+        account = cache.ACCOUNTS.get('email', self.email)
+        assert account.default_frequency == 'monthly'
+
+        handler = self.simulate_request('/subscribe?subdomain=haiti&' +
+                                        'action=change_email_format&' +
+                                        'email_format=html')
+        handler.post()
+        assert cache.ACCOUNTS.get('email', self.email).email_format == 'html'
+
     def simulate_request(self, path):
         request = webapp.Request(webob.Request.blank(path).environ)
         response = webapp.Response()
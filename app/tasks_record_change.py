@@ -12,14 +12,20 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import rendering
-import utils
+"""Internal task to record a change to a Subject for the delta clients,
+queued by model.SubjectChange.queue_record.  If recording fails, the task
+fails and is retried."""
+
+from model import SubjectChange
+from utils import Handler, run
+
+
+class RecordChange(Handler):
+    def post(self):
+        SubjectChange.record(
+            self.subdomain, self.request.get('subject_name'),
+            bool(self.request.get('purged')))
 
-class RefreshJsonCache(utils.Handler):
-    """Refreshes the json cache, presumably via an asynchronous task."""
-    def get(self):
-        if self.subdomain:
-            rendering.render_json(self.subdomain)
 
 if __name__ == '__main__':
-    utils.run([('/refresh_json_cache', RefreshJsonCache)], debug=True)
+    run([('/tasks/record_change', RecordChange)], debug=True)
@@ -0,0 +1,68 @@
+# Copyright 2010 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for tasks_record_change.py."""
+
+import urllib
+import webob
+
+from google.appengine.ext import webapp
+
+import model
+import tasks_record_change
+from medium_test_case import MediumTestCase
+from model import DataVersion, SubjectChange
+
+class RecordChangeTest(MediumTestCase):
+    def setUp(self):
+        MediumTestCase.setUp(self)
+        # Run the queued tasks here instead of queueing them.
+        self.tasks = []
+        self.add = model.taskqueue.add
+        model.taskqueue.add = lambda **kwargs: self.tasks.append(kwargs)
+
+    def tearDown(self):
+        model.taskqueue.add = self.add
+
+    def run_task(self, task):
+        request = webapp.Request(webob.Request.blank(
+            task['url'], POST=urllib.urlencode(task['params'])).environ)
+        handler = tasks_record_change.RecordChange()
+        handler.initialize(request, webapp.Response(), None)
+        handler.post()
+
+    def test_record_change(self):
+        """Confirms that the queued task records the change to the Subject,
+        and that the task is added in the caller's transaction."""
+        SubjectChange.queue_record('haiti', 'example.org/1')
+        SubjectChange.queue_record('haiti', 'example.org/2', purged=True)
+        assert [task['transactional'] for task in self.tasks] == [True, True]
+        assert SubjectChange.all_since('haiti', 0).count() == 0
+
+        for task in self.tasks:
+            self.run_task(task)
+        assert DataVersion.get_version('haiti') == 2
+        assert [(change.subject_name, change.version, change.purged)
+                for change in SubjectChange.all_since('haiti', 0)] == [
+            ('example.org/1', 1, False), ('example.org/2', 2, True)]
+
+    def test_record_multi(self):
+        """Confirms that record_multi records all the changes under one
+        new DataVersion."""
+        assert SubjectChange.record_multi(
+            'haiti', ['example.org/1', 'example.org/2']) == 1
+        assert [(change.subject_name, change.version) for change in
+                SubjectChange.all_since('haiti', 0)] == [
+            ('example.org/1', 1), ('example.org/2', 1)]
+        assert SubjectChange.record('haiti', 'example.org/1') == 2
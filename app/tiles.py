@@ -0,0 +1,41 @@
+# Copyright 2010 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Handler for the subjects located in one map tile, at /tiles/zoom/x/y with
+tiles numbered as in Google Maps (see feedlib.geo.get_tile)."""
+
+import cache
+import rendering
+import utils
+from utils import ErrorMessage
+
+class Tiles(utils.Handler):
+    def get(self, zoom, x, y):
+        if not self.subdomain:
+            raise ErrorMessage(400, 'No subdomain specified.')
+
+        # Need 'view' permission to see the data.
+        self.require_action_permitted('view')
+
+        zoom, x, y = int(zoom), int(x), int(y)
+        if zoom > cache.MAX_TILE_ZOOM or x >= 2**zoom or y >= 2**zoom:
+            raise ErrorMessage(404, 'No such tile.')
+
+        # The payload has unquoted keys, so it is JavaScript rather than JSON.
+        self.response.headers['Content-Type'] = 'text/javascript'
+        self.response.headers['Cache-Control'] = 'no-cache'
+        self.write(rendering.render_tile_json(self.subdomain, zoom, x, y))
+
+if __name__ == '__main__':
+    utils.run([(r'/tiles/(\d+)/(\d+)/(\d+)', Tiles)], debug=True)
@@ -120,6 +120,10 @@ class Handler(webapp.RequestHandler):
     # Handlers that require HTTPS can set this to True.
     https_required = False
 
+    # Handlers whose responses can be cached publicly set this to False, so
+    # that the response doesn't set the language cookie (see select_lang).
+    lang_cookie = True
+
     auto_params = {
         'iframe': validate_yes,
         'embed': validate_yes,
@@ -164,6 +168,17 @@ class Handler(webapp.RequestHandler):
     def write(self, text):
         self.response.out.write(text)
 
+    def check_etag(self, etag):
+        """Sets the ETag header of the response.  If the request's
+        If-None-Match header already has this ETag, sets the status to 304
+        and returns True; the caller should then write nothing more."""
+        self.response.headers['ETag'] = etag
+        if_none_match = self.request.headers.get('If-None-Match', '')
+        if etag in [tag.strip() for tag in if_none_match.split(',')]:
+            self.response.set_status(304)
+            return True
+        return False
+
     def terminate_response(self):
         """Prevents any further output from being written."""
         self.response.out.write = lambda *args: None
@@ -201,10 +216,18 @@ class Handler(webapp.RequestHandler):
         # The 'subdomain' query parameter always overrides the hostname.
         self.subdomain = self.request.get('subdomain', self.subdomain)
 
-        # To be safe, we purge the in-memory portion of MinimalSubjectCache
-        # before each request to be sure we don't see stale data.
-        if self.subdomain:
-            cache.MINIMAL_SUBJECTS[self.subdomain].flush_local()
+        # Bring the caches used by most requests up to date in a couple of
+        # memcache round trips.  This also makes sure we don't see stale
+        # MinimalSubjects if they have been edited (on any instance) since
+        # they were loaded into local memory.
+        # The subdomain comes from the request, so only look up the caches
+        # for subdomains that exist.
+        cache_names = ['SubdomainCache', 'DefaultAccountCache',
+                       'AttributeCache', 'MessageCache']
+        if self.subdomain and self.subdomain in cache.SUBDOMAINS:
+            cache_names += ['SubjectTypeCache', 'MinimalSubjectCache']
+        cache.prefetch(self.subdomain, cache_names)
+        cache.SUBJECTS.flush_local()
 
         # Validate the query parameters and collect the validated values.
         self.params = Struct()
@@ -257,12 +280,14 @@ class Handler(webapp.RequestHandler):
         if self.account and lang != self.account.locale:
             self.account.locale = lang
             db.put(self.account)
+            cache.ACCOUNTS.invalidate(self.account)
 
         # Activate the selected language.
         django.utils.translation.activate(lang)
         self.params.lang_bidi = django.utils.translation.get_language_bidi()
-        self.response.headers.add_header(
-            'Set-Cookie', 'django_language=%s' % lang)
+        if self.lang_cookie:
+            self.response.headers.add_header(
+                'Set-Cookie', 'django_language=%s' % lang)
         self.response.headers.add_header('Content-Language', lang)
 
     def get_subdomain_root(self, subdomain):
@@ -370,6 +395,11 @@ def format(value, localize=False, locale=''):
     return value_or_dash(value)
 
 def get_last_updated_time(subject):
+    """Gets the latest observed time of any attribute value of a Subject.
+    Subjects that predate Subject.last_updated fall back to scanning the
+    observed times of all their attributes."""
+    if subject.last_updated:
+        return subject.last_updated
     type = cache.SUBJECT_TYPES[subject.subdomain][subject.type]
     return max(subject.get_observed(name) for name in type.attribute_names
                if subject.get_observed(name) is not None)
@@ -36,7 +36,7 @@ import django.utils.translation
 
 from feedlib.errors import ErrorMessage, Redirect
 from medium_test_case import MediumTestCase
-from model import Account, Message, Subject, SubjectType
+from model import Account, Message, Subdomain, Subject, SubjectType
 
 SAN_FRANCISCO = {'lat': 40.7142, 'lon': -74.0064}
 
@@ -119,6 +119,25 @@ class HandlerTest(MediumTestCase):
         handler = self.simulate_request('/?subdomain=haiti', 'foo@example.com')
         handler.require_logged_in_user()
 
+    def test_prefetch(self):
+        """Confirms that the caches for a subdomain are looked up only if the
+        subdomain exists."""
+        Subdomain(key_name='pakistan').put()
+        cache.SUBDOMAINS.flush()
+        for group in [cache.SUBJECT_TYPES, cache.MINIMAL_SUBJECTS]:
+            group.caches.pop('pakistan', None)
+            group.caches.pop('nosuch', None)
+        try:
+            self.simulate_request('/?subdomain=nosuch')
+            assert 'nosuch' not in cache.MINIMAL_SUBJECTS.caches
+            assert 'nosuch' not in cache.SUBJECT_TYPES.caches
+            self.simulate_request('/?subdomain=pakistan')
+            assert cache.MINIMAL_SUBJECTS.caches['pakistan'].entities == {}
+            assert cache.SUBJECT_TYPES.caches['pakistan'].entities == {}
+        finally:
+            db.delete(Subdomain.get_by_key_name('pakistan'))
+            cache.SUBDOMAINS.flush()
+
     def test_select_lang(self):
         """Confirm select_lang works as expected"""
         # Default language should be English.
@@ -170,6 +189,19 @@ class HandlerTest(MediumTestCase):
         assert utils.get_lang() == 'es-419'
         assert utils.get_locale() == 'es_419'
 
+        # The language is remembered in a cookie, unless the handler's
+        # responses are cached publicly.
+        handler = self.simulate_request('/?lang=fr')
+        assert handler.response.headers.get_all('Set-Cookie') == [
+            'django_language=fr']
+        utils.Handler.lang_cookie = False
+        try:
+            handler = self.simulate_request('/?lang=fr')
+        finally:
+            utils.Handler.lang_cookie = True
+        assert handler.response.headers.get_all('Set-Cookie') == []
+        assert handler.response.headers['Content-Language'] == 'fr'
+
 
 class UtilsTest(MediumTestCase):
     def setUp(self):
@@ -14,10 +14,19 @@
 
 """Geographical functions.  All measurements are in metres."""
 
-from math import asin, cos, pi, sin, sqrt
+import heapq
+from math import asin, ceil, cos, floor, log, pi, sin, sqrt, tan
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 EARTH_RADIUS = 6371009
 
+# Latitudes beyond this many degrees are outside the Web Mercator projection.
+MAX_MERCATOR_LAT = 85.0511287798
+
 def hav(theta):
     """Computes the haversine of an angle given in radians."""
     return sin(theta/2)**2
@@ -36,6 +45,66 @@ def distance(start, finish):
     finish_rad = (finish['lat']*pi/180, finish['lon']*pi/180)
     return central_angle(start_rad, finish_rad)*EARTH_RADIUS
 
+def distances(origin, lats, lons):
+    """Approximates the distances in metres from one point on the Earth,
+    given as a {'lat':y, 'lon':x} object in degrees, to each of a sequence
+    of points whose latitudes and longitudes in degrees are given in two
+    parallel sequences.  Returns a list of distances.  Uses NumPy to compute
+    all the distances at once when it is available."""
+    phi_s, lam_s = origin['lat']*pi/180, origin['lon']*pi/180
+    if numpy is not None:
+        phi_f = numpy.radians(numpy.asarray(lats, dtype=float))
+        lam_f = numpy.radians(numpy.asarray(lons, dtype=float))
+        angles = 2*numpy.arcsin(numpy.sqrt(
+            numpy.sin((phi_s - phi_f)/2)**2 +
+            cos(phi_s)*numpy.cos(phi_f)*numpy.sin((lam_s - lam_f)/2)**2))
+        return (angles*EARTH_RADIUS).tolist()
+    cos_phi_s = cos(phi_s)
+    results = []
+    for lat, lon in zip(lats, lons):
+        phi_f, lam_f = lat*pi/180, lon*pi/180
+        angle = 2*asin(sqrt(hav(phi_s - phi_f) +
+                            cos_phi_s*cos(phi_f)*hav(lam_s - lam_f)))
+        results.append(angle*EARTH_RADIUS)
+    return results
+
+def bounding_box(center, radius):
+    """Returns a box (south, west, north, east) in degrees that contains all
+    points within the given radius of the center, given as a {'lat':y,
+    'lon':x} object in degrees.  If west > east, the box crosses the 180th
+    meridian.  If the circle contains a pole, the box spans all longitudes."""
+    d_lat = radius*180/(pi*EARTH_RADIUS)
+    south = max(center['lat'] - d_lat, -90)
+    north = min(center['lat'] + d_lat, 90)
+    cos_lat = cos((abs(center['lat']) + d_lat)*pi/180)
+    if cos_lat <= 0 or d_lat/cos_lat >= 180:
+        return south, -180, north, 180
+    d_lon = d_lat/cos_lat
+    west = (center['lon'] - d_lon + 180) % 360 - 180
+    east = (center['lon'] + d_lon + 180) % 360 - 180
+    return south, west, north, east
+
+def in_bounding_box(lat, lon, (south, west, north, east)):
+    """Returns true if the point at the given latitude and longitude in
+    degrees is inside a box returned by bounding_box."""
+    if not south <= lat <= north:
+        return False
+    if west <= east:
+        return west <= lon <= east
+    return lon >= west or lon <= east
+
+def get_tile(point, zoom):
+    """Gets the (x, y) coordinates of the Web Mercator map tile at the given
+    zoom level that contains the given {'lat':y, 'lon':x} point in degrees.
+    As in Google Maps, there are 2**zoom by 2**zoom tiles, numbered from the
+    north-west corner."""
+    n = 2**zoom
+    lat = max(-MAX_MERCATOR_LAT, min(MAX_MERCATOR_LAT, point['lat']))
+    phi = lat*pi/180
+    x = int(floor((point['lon'] + 180)/360*n))
+    y = int(floor((1 - log(tan(phi) + 1/cos(phi))/pi)/2*n))
+    return x % n, max(0, min(n - 1, y))
+
 def point_inside_polygon(point, poly):
     """Returns true if the given point is inside the given polygon.
     point is given as an {'lat':y, 'lon':x} object in degrees
@@ -64,3 +133,69 @@ def point_inside_polygon(point, poly):
                     inside = not inside
         lon1, lat1 = lon2, lat2
     return inside
+
+
+class GridIndex:
+    """A spatial index of items at points on the Earth, bucketed into cells
+    of cell_size degrees of latitude by cell_size degrees of longitude.
+    Points are given as {'lat':y, 'lon':x} objects in degrees."""
+    def __init__(self, cell_size=0.1):
+        self.cell_size = cell_size
+        self.rows = int(ceil(180/cell_size))
+        self.cols = int(ceil(360/cell_size))
+        self.cells = {}  # {(row, col): [(lat, lon, item), ...]}
+
+    def get_row(self, lat):
+        return min(max(int(floor((lat + 90)/self.cell_size)), 0), self.rows - 1)
+
+    def get_col(self, lon):
+        return int(floor((lon + 180)/self.cell_size)) % self.cols
+
+    def add(self, point, item):
+        """Adds an item at the given point."""
+        lat, lon = point['lat'], point['lon']
+        cell = (self.get_row(lat), self.get_col(lon))
+        self.cells.setdefault(cell, []).append((lat, lon, item))
+
+    def get_cells(self, box):
+        """Returns the cells that overlap a box returned by bounding_box.
+        When the box spans more cells than are occupied, only the occupied
+        cells are returned."""
+        south, west, north, east = box
+        first_row, last_row = self.get_row(south), self.get_row(north)
+        rows = range(first_row, last_row + 1)
+        if west == -180 and east == 180:
+            cols = range(self.cols)
+        else:
+            start, end = self.get_col(west), self.get_col(east)
+            if west > east and end <= start:  # crosses the 180th meridian
+                end += self.cols
+            cols = [col % self.cols for col in range(start, end + 1)]
+        if len(rows)*len(cols) > len(self.cells):
+            cols = set(cols)
+            return [(row, col) for (row, col) in self.cells
+                    if first_row <= row <= last_row and col in cols]
+        return [(row, col) for row in rows for col in cols]
+
+    def nearest(self, center, radius=None, limit=None):
+        """Returns a list of (distance, item) pairs for the items within the
+        given radius of the center (or all items, if radius is None), nearest
+        first.  Only the cells that overlap the circle are examined, and only
+        points inside its bounding box are measured.  If limit is given,
+        returns at most that many items."""
+        if radius is None:
+            box, cells = None, self.cells.keys()
+        else:
+            box = bounding_box(center, radius)
+            cells = self.get_cells(box)
+        lats, lons, items = [], [], []
+        for cell in cells:
+            for lat, lon, item in self.cells.get(cell, ()):
+                if box is None or in_bounding_box(lat, lon, box):
+                    lats.append(lat)
+                    lons.append(lon)
+                    items.append(item)
+        results = [(d, item) for d, item in
+                   zip(distances(center, lats, lons), items)
+                   if radius is None or d <= radius]
+        return heapq.nsmallest(limit or len(results), results)
@@ -25,3 +25,81 @@ class GeoTest(unittest.TestCase):
     def test_distance(self):
         assert 4128000 < geo.distance(SAN_FRANCISCO, NEW_YORK) < 4130000
         assert 4128000 < geo.distance(NEW_YORK, SAN_FRANCISCO) < 4130000
+
+    def test_distances(self):
+        points = [SAN_FRANCISCO, NEW_YORK, {'lat': 40.7, 'lon': -74.1}]
+        results = geo.distances(SAN_FRANCISCO, [p['lat'] for p in points],
+                                [p['lon'] for p in points])
+        assert len(results) == 3
+        for point, result in zip(points, results):
+            assert abs(result - geo.distance(SAN_FRANCISCO, point)) < 0.01
+        assert geo.distances(SAN_FRANCISCO, [], []) == []
+
+    def test_bounding_box(self):
+        box = geo.bounding_box(SAN_FRANCISCO, 10000)
+        south, west, north, east = box
+        assert south < SAN_FRANCISCO['lat'] < north
+        assert west < SAN_FRANCISCO['lon'] < east
+        assert geo.in_bounding_box(40.7, -74.1, box)
+        assert not geo.in_bounding_box(NEW_YORK['lat'], NEW_YORK['lon'], box)
+
+        # A box around the 180th meridian wraps around.
+        box = geo.bounding_box({'lat': 0, 'lon': 180}, 10000)
+        assert box[1] > box[3]
+        assert geo.in_bounding_box(0, 179.99, box)
+        assert geo.in_bounding_box(0, -179.99, box)
+        assert not geo.in_bounding_box(0, 0, box)
+
+        # A box around a pole spans all longitudes.
+        assert geo.bounding_box({'lat': 89.99, 'lon': 0}, 10000)[1:4:2] == (
+            -180, 180)
+
+    def test_get_tile(self):
+        assert geo.get_tile(SAN_FRANCISCO, 0) == (0, 0)
+        assert geo.get_tile(SAN_FRANCISCO, 1) == (0, 0)
+        assert geo.get_tile({'lat': -33.9, 'lon': 151.2}, 1) == (1, 1)
+        assert geo.get_tile(NEW_YORK, 10) == (163, 395)
+        assert geo.get_tile({'lat': 90, 'lon': 180}, 2) == (0, 0)
+        assert geo.get_tile({'lat': -90, 'lon': -180}, 2) == (0, 3)
+
+    def test_grid_index(self):
+        index = geo.GridIndex(cell_size=1)
+        index.add(SAN_FRANCISCO, 'sf')
+        index.add(NEW_YORK, 'ny')
+        index.add({'lat': 40.7, 'lon': -74.1}, 'near_sf')
+        index.add({'lat': 40.7, 'lon': 179.9}, 'east')
+        index.add({'lat': 40.7, 'lon': -179.9}, 'west')
+
+        # Only nearby items are returned, nearest first.
+        results = index.nearest(SAN_FRANCISCO, 10000)
+        assert [item for d, item in results] == ['sf', 'near_sf']
+        assert results[0][0] == 0
+        assert [item for d, item in index.nearest(SAN_FRANCISCO, 10000, 1)
+                ] == ['sf']
+        assert len(index.nearest(SAN_FRANCISCO, 5000000)) == 3
+
+        # Circles that cross the 180th meridian find items on both sides.
+        results = index.nearest({'lat': 40.7, 'lon': 180}, 20000)
+        assert sorted([item for d, item in results]) == ['east', 'west']
+
+        # With no radius, all items are returned.
+        assert len(index.nearest(SAN_FRANCISCO)) == 5
+
+    def test_grid_index_get_cells(self):
+        index = geo.GridIndex(cell_size=1)
+        index.add(SAN_FRANCISCO, 'sf')
+        index.add(NEW_YORK, 'ny')
+        index.add({'lat': 40.7, 'lon': 179.9}, 'east')
+        index.add({'lat': 40.7, 'lon': -179.9}, 'west')
+
+        # A box smaller than the number of occupied cells gets all its cells.
+        box = geo.bounding_box(SAN_FRANCISCO, 10000)
+        assert index.get_cells(box) == [(130, 105), (130, 106)]
+
+        # A larger box gets just the occupied cells inside it.
+        box = geo.bounding_box(SAN_FRANCISCO, 3000000)
+        assert sorted(index.get_cells(box)) == [(127, 57), (130, 105)]
+        box = geo.bounding_box({'lat': 40.7, 'lon': 180}, 200000)
+        assert sorted(index.get_cells(box)) == [(130, 0), (130, 359)]
+        assert sorted(index.get_cells((-90, -180, 90, 180))) == \
+            sorted(index.cells.keys())
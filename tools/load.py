@@ -21,6 +21,7 @@ import re
 import zipfile
 from StringIO import StringIO
 
+import cache
 import kml
 import setup
 from feedlib.geo import point_inside_polygon
@@ -457,7 +458,11 @@ def load(
             if name in subject_type.minimal_attribute_names:
                 minimal_subject.set_attribute(name, info.value)
 
+    for subject, minimal_subject in zip(subjects, minimal_subjects):
+        minimal_subject.last_updated = subject.last_updated
     put_batches(subjects + minimal_subjects + reports)
+    cache.flush_all()  # flush any cached copies of the replaced Subjects
+    record_changes(subdomain, [subject.name for subject in subjects])
 
 def parse_paho_date(date):
     """Parses a period-separated (month.day.year) date, passes through None.
@@ -487,6 +492,13 @@ def put_batches(entities):
         count += len(batch)
         logging.info('Stored %d of %d entities.' % (count, total))
 
+def record_changes(subdomain, subject_names, purged=False):
+    """Records changes to the given Subjects for the delta clients (see
+    SubjectChange), 200 Subjects to a DataVersion."""
+    while subject_names:
+        batch, subject_names = subject_names[:200], subject_names[200:]
+        SubjectChange.record_multi(subdomain, batch, purged)
+
 def parse_datetime(timestamp):
     """Parses a UTC timestamp in YYYY-MM-DD HH:MM:SS format.  Acceptable
     examples are "2010-02-07", "2010-02-07 19:31", "2010-02-07T13:02:03Z"."""
@@ -536,12 +548,17 @@ def delete_pakistan_kml():
                'Subject': subjects,
                'MinimalSubject': minimal_subjects}
 
+    subject_names = []
     for kind, query in queries.items():
         keys = query.fetch(200)
         while keys:
             logging.info('%s: deleting %d...' % (kind, len(keys)))
             db.delete(keys)
+            if kind == 'Subject':
+                subject_names += [key.name().split(':', 1)[1] for key in keys]
             keys = query.fetch(200)
+    cache.flush_all()  # flush any cached copies of the deleted Subjects
+    record_changes('pakistan', subject_names, purged=True)
 
 
 def fix_batool():
@@ -596,3 +613,5 @@ def fix_batool():
     subject.put()
     minimal_subject.put()
     report.put()
+    cache.flush_subject(subject.subdomain, subject.name, subject)
+    SubjectChange.record(subject.subdomain, subject.name)